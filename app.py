@@ -1,76 +1,242 @@
-from flask import Flask, redirect, request, jsonify
+from flask import Flask, Response, g, redirect, request, jsonify
+import math
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
 import requests
 from dotenv import load_dotenv
-from threading import Timer, Lock
 from flask_cors import CORS
-import json
 
-# Load environment variables
+# Load environment variables before the modules that read them at import
 load_dotenv()
 
+import metrics
+import spotify_client
+from classifier import classifier
+from device_cache import DeviceCache
+from events import EventQueue, QueueFull, create_event_statuses, reduce_batch
+from logging_setup import configure_logging
+from rate_limit import RateGovernor, RateLimited, Throttled
+from scheduler import PlaybackScheduler
+from token_manager import TokenManager, TokenUnavailable
+from token_store import CachedTokenStore, create_token_store, migrate_json_tokens
+from tracks import TrackRegistry
+from user_state import create_user_state
+
+logger = configure_logging()
+
 app = Flask(__name__)
 CORS(app)
 app.secret_key = 'your_secret_key'
+# Large build logs can be posted for classification, but not unbounded ones
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_REQUEST_BYTES", str(16 * 1024 * 1024)))
 
 # Spotify API credentials
 CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI')
 
-# Token storage and timers
-tokens = {}
-active_timer = None
-lock = Lock()
+# Queue play events in the background and answer 202 unless a request says otherwise
+ASYNC_EVENTS = os.getenv("ASYNC_EVENTS", "false").lower() in ("1", "true", "yes")
+BATCH_MAX_EVENTS = int(os.getenv("BATCH_MAX_EVENTS", "500"))
+# Sync batches play users in parallel and answer within BATCH_TIMEOUT seconds, well inside
+# gunicorn's worker timeout
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "20"))
+
+# Token storage and auto-pause scheduling
+scheduler = PlaybackScheduler(workers=int(os.getenv("SCHEDULER_WORKERS", "4")))
 TOKEN_FILE = "spotify_tokens.json"
+TOKEN_STORE = os.getenv("TOKEN_STORE", "sqlite")
+TOKEN_DB = os.getenv("TOKEN_DB", "spotify_tokens.db")
+token_store = CachedTokenStore(create_token_store(TOKEN_STORE, TOKEN_DB))
+# Each user's latest play and Spotify cool-down, shared by every worker next to the tokens
+user_state = create_user_state(TOKEN_STORE, TOKEN_DB)
+
+# Success/error tracks, loaded once and hot-reloaded when the file changes
+track_registry = TrackRegistry(
+    os.getenv("TRACKS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracks.json")),
+    reload_interval=float(os.getenv("TRACKS_RELOAD_INTERVAL", "2")),
+)
+
+# Admission control for Spotify calls (budgets are per worker, cool-downs are shared)
+rate_governor = RateGovernor(
+    global_rate=float(os.getenv("SPOTIFY_GLOBAL_RATE", "20")),
+    global_burst=float(os.getenv("SPOTIFY_GLOBAL_BURST", "40")),
+    user_rate=float(os.getenv("SPOTIFY_USER_RATE", "2")),
+    user_burst=float(os.getenv("SPOTIFY_USER_BURST", "6")),
+    max_inflight=int(os.getenv("SPOTIFY_MAX_INFLIGHT", "64")),
+    cooldowns=user_state,
+)
+
+# Last known playback device per user
+device_cache = DeviceCache(
+    ttl=int(os.getenv("DEVICE_CACHE_TTL", "300")),
+    max_size=int(os.getenv("DEVICE_CACHE_SIZE", "1024")),
+)
+
+
+# Startup work: how many users to cache up front and connections to open per Spotify host
+TOKEN_WARM_USERS = int(os.getenv("TOKEN_WARM_USERS", "1000"))
+WARM_CONNECTIONS = int(os.getenv("SPOTIFY_WARM_CONNECTIONS", "2"))
+
+_tokens_loaded = False
+_warmed_pid = None
+
+
+# Import users from the legacy token file and cache the most active ones. Runs once per
+# process tree: with gunicorn's preload_app the master does it and workers inherit the cache.
+def load_tokens():
+    global _tokens_loaded
+    if _tokens_loaded:
+        return
+    migrated = migrate_json_tokens(token_store, TOKEN_FILE)
+    if migrated:
+        logger.info("Migrated legacy token file", extra={"users": migrated, "path": TOKEN_FILE})
+    cached = token_store.warm(TOKEN_WARM_USERS)
+    logger.info("Tokens loaded", extra={"users": cached})
+    _tokens_loaded = True
+    release_connections()
+
+
+# Close this process's database and Spotify connections. With preload_app this runs in the
+# master before any worker forks, so only the cached records cross the fork; each worker opens
+# its own.
+def release_connections():
+    token_store.close()
+    user_state.close()
+    event_queue.statuses.close()
+    spotify_client.close_sessions()
+
+
+# Per-process warm-up, run in each worker after it forks: pooled connections are never
+# shared across a fork, so they cannot be opened in the master
+def warm_up():
+    global _warmed_pid
+    load_tokens()
+    started = time.perf_counter()
+    opened = spotify_client.warm_up(WARM_CONNECTIONS)
+    metrics.start_flusher()
+    _warmed_pid = os.getpid()
+    logger.info("Worker warmed up", extra={"connections": opened, "seconds": round(time.perf_counter() - started, 3)})
 
 
-# Load tokens from file
-def load_tokens():
-    global tokens
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, "r") as f:
-            tokens.update(json.load(f))
-    print("Tokens loaded:", tokens)
+def is_ready():
+    return _warmed_pid == os.getpid()
 
 
-# Save tokens to file
-def save_tokens():
-    with open(TOKEN_FILE, "w") as f:
-        json.dump(tokens, f)
-    print("Tokens saved:", tokens)
+# App factory (see gunicorn.conf.py). Tokens are loaded here; connections are warmed by the
+# gunicorn post_worker_init hook, or right away with warm=True for single-process servers.
+def create_app(warm=False):
+    load_tokens()
+    if warm:
+        warm_up()
+    return app
+
+
+token_manager = TokenManager(
+    token_store.get,
+    token_store.put,
+    CLIENT_ID,
+    CLIENT_SECRET,
+    refresh_margin=int(os.getenv("TOKEN_REFRESH_MARGIN", "60")),
+)
 
 
 # Refresh access token
 def refresh_access_token(user_id):
-    user_tokens = tokens.get(user_id)
-    if not user_tokens:
-        print(f"No tokens found for user {user_id}")
-        return None
+    return token_manager.refresh(user_id)
 
-    refresh_token = user_tokens.get("refresh_token")
-    if not refresh_token:
-        print(f"No refresh token for user {user_id}")
-        return None
 
-    token_url = "https://accounts.spotify.com/api/token"
-    payload = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-    }
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post(token_url, data=payload, headers=headers)
+metrics.PENDING_PAUSES.set_function(scheduler.pending)
+metrics.ADMITTED_EVENTS.set_function(rate_governor.inflight)
 
-    if response.status_code == 200:
-        access_token = response.json().get("access_token")
-        tokens[user_id]["access_token"] = access_token
-        save_tokens()
-        return access_token
-    else:
-        print(f"Failed to refresh token for user {user_id}: {response.json()}")
-        return None
+
+# Spotify's error body for diagnostics; tolerates empty and non-JSON bodies
+def error_details(response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text[:500] or None
+
+
+# JSON response that carries a Retry-After header whenever the body has a retry hint
+def json_response(body, status=200):
+    response = jsonify(body)
+    response.status_code = status
+    if "retry_after" in body:
+        response.headers["Retry-After"] = str(body["retry_after"])
+    return response
+
+
+def throttled_body(e):
+    metrics.THROTTLED.inc(reason=type(e).__name__)
+    return {"error": e.reason, "retry_after": e.retry_after}, e.status
+
+
+# Call Spotify for a user through the token manager. Budgets are charged per event by the
+# caller (rate_governor.admitted); each call only honours the user's cool-down. A 429 starts
+# that cool-down from Retry-After and raises RateLimited instead of being passed back.
+def user_call(user_id, request_fn):
+    def governed(access_token):
+        rate_governor.check_cooldown(user_id)
+        response = request_fn(access_token)
+        if response.status_code == 429:
+            retry_after = rate_governor.observe_rate_limit(user_id, response.headers.get("Retry-After"))
+            raise RateLimited("Spotify rate limit reached", retry_after)
+        return response
+
+    return token_manager.call(user_id, governed)
+
+
+# Per-route latency and in-flight request tracking
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def observe_request(exc):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    metrics.REQUESTS_IN_FLIGHT.dec()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    status = g.pop("response_status", 500)
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method, status=status)
+
+
+# Liveness: the process is up and serving requests
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+# Readiness: this worker has finished warm-up and can reach the token store
+@app.route('/readyz')
+def readyz():
+    checks = {"warmed_up": is_ready()}
+    try:
+        token_store.version()
+        checks["token_store"] = True
+    except Exception as e:
+        logger.warning("Token store check failed", extra={"error": str(e)})
+        checks["token_store"] = False
+    ready = all(checks.values())
+    return jsonify({"status": "ready" if ready else "starting", "checks": checks}), 200 if ready else 503
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.collect(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route('/')
@@ -83,7 +249,7 @@ def home():
 def login():
     scope = "user-read-playback-state user-modify-playback-state"
     auth_url = (
-        f"https://accounts.spotify.com/authorize"
+        f"{spotify_client.ACCOUNTS_BASE}/authorize"
         f"?client_id={CLIENT_ID}"
         f"&response_type=code"
         f"&redirect_uri={REDIRECT_URI}"
@@ -96,7 +262,6 @@ def login():
 @app.route('/callback')
 def callback():
     code = request.args.get('code')
-    token_url = "https://accounts.spotify.com/api/token"
     payload = {
         "grant_type": "authorization_code",
         "code": code,
@@ -104,40 +269,36 @@ def callback():
         "client_id": CLIENT_ID,
         "client_secret": CLIENT_SECRET,
     }
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post(token_url, data=payload, headers=headers)
+    try:
+        response = spotify_client.accounts_post("/api/token", payload)
+    except requests.RequestException as e:
+        return jsonify({"error": "Failed to reach Spotify", "details": str(e)}), 502
 
     if response.status_code == 200:
         data = response.json()
         access_token = data.get('access_token')
-        refresh_token = data.get('refresh_token')
 
         # Fetch user info using the access token
-        user_info = requests.get(
-            "https://api.spotify.com/v1/me",
-            headers={"Authorization": f"Bearer {access_token}"}
-        ).json()
+        try:
+            user_info = spotify_client.api_get("/me", access_token).json()
+        except requests.RequestException as e:
+            return jsonify({"error": "Failed to reach Spotify", "details": str(e)}), 502
 
         user_id = user_info.get('id')
 
         if user_id:
-            tokens[user_id] = {
-                "access_token": access_token,
-                "refresh_token": refresh_token
-            }
-            save_tokens()
+            token_store.put(user_id, TokenManager.record_from_response(data))
             return jsonify({"message": "Logged in successfully!", "user_id": user_id})
         else:
             return jsonify({"error": "Failed to fetch user info from Spotify."})
     else:
-        return jsonify({"error": "Failed to get token", "details": response.json()})
+        return jsonify({"error": "Failed to get token", "details": error_details(response)})
 
 
 @app.route('/vscode/check_login_status', methods=['GET'])
 def check_login_status():
-    if tokens:
-        for user_id in tokens.keys():
-            return jsonify({"logged_in": True, "user_id": user_id})
+    for user_id in token_store.user_ids(limit=1):
+        return jsonify({"logged_in": True, "user_id": user_id})
     return jsonify({"logged_in": False})
 
 
@@ -155,135 +316,308 @@ def manual_refresh_token():
         return jsonify({"error": "Failed to refresh access token"}), 500
 
 
-@app.route('/vscode/success', methods=['POST'])
-def handle_success_event():
-    data = request.json
-    user_id = data.get("user_id")
-    if not user_id:
-        return jsonify({"error": "User ID is missing"}), 400
-
-    user_tokens = tokens.get(user_id)
-    if not user_tokens:
-        return jsonify({"error": f"No tokens found for user {user_id}"}), 401
-
-    access_token = user_tokens.get("access_token")
-    if not access_token:
-        access_token = refresh_access_token(user_id)
-        if not access_token:
-            return jsonify({"error": "No valid access token available"}), 401
-
-    # Fetch active devices
-    devices_url = "https://api.spotify.com/v1/me/player/devices"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    devices_response = requests.get(devices_url, headers=headers)
+# Look up the user's first available device and remember it
+def lookup_device(user_id):
+    metrics.DEVICE_LOOKUPS.inc()
+    devices_response = user_call(
+        user_id, lambda access_token: spotify_client.api_get("/me/player/devices", access_token)
+    )
 
     if devices_response.status_code != 200:
-        return jsonify({"error": "Failed to fetch devices", "details": devices_response.json()}), 500
+        return None, ({"error": "Failed to fetch devices", "details": error_details(devices_response)}, 500)
 
     devices = devices_response.json().get("devices", [])
     if not devices:
-        return jsonify({"error": "No active devices found for the user"}), 404
+        return None, ({"error": "No active devices found for the user"}, 404)
 
-    # Use the first available device
     target_device_id = devices[0]["id"]
+    device_cache.set(user_id, target_device_id)
+    return target_device_id, None
+
+
+# Start a track, skipping the device lookup when a hint or cached device is known.
+# A 404 from a hinted or cached device drops it and retries once with a fresh lookup.
+def play_on_device(user_id, track_uri, position_ms, device_hint=None):
+    target_device_id = device_hint or device_cache.get(user_id)
+    known_device = target_device_id is not None
+    metrics.DEVICE_CACHE.inc(result="hint" if device_hint else "hit" if known_device else "miss")
+    if not known_device:
+        target_device_id, error = lookup_device(user_id)
+        if error:
+            return None, None, error
 
-    # Play the track
-    play_url = "https://api.spotify.com/v1/me/player/play"
     payload = {
-        "uris": ["spotify:track:0O3ow3j5y8q3ykRs2K2n1b"],
+        "uris": [track_uri],
         "device_id": target_device_id,
-        "position_ms": 45000
+        "position_ms": position_ms
     }
-    response = requests.put(play_url, headers=headers, json=payload)
 
-    if response.status_code == 204:
-        global active_timer
-        with lock:
-            if active_timer:
-                active_timer.cancel()
+    def play(access_token):
+        return spotify_client.api_put("/me/player/play", access_token, json=payload)
 
-        def stop_playback():
-            stop_url = "https://api.spotify.com/v1/me/player/pause"
-            requests.put(stop_url, headers=headers, params={"device_id": target_device_id})
+    response = user_call(user_id, play)
 
-        with lock:
-            active_timer = Timer(15, stop_playback)
-            active_timer.start()
+    if response.status_code == 404 and known_device:
+        device_cache.invalidate(user_id)
+        target_device_id, error = lookup_device(user_id)
+        if error:
+            return None, None, error
+        payload["device_id"] = target_device_id
+        response = user_call(user_id, play)
 
-        return jsonify({"message": f"Success track playing for user {user_id}"})
+    if response.status_code == 204:
+        device_cache.set(user_id, target_device_id)
+    return target_device_id, response, None
+
+
+# Pause the user's device after stop_time_ms, replacing any pause pending for that device.
+# A throttled pause is retried once the cool-down ends unless a newer event rescheduled it.
+# The pause is skipped once play_id is no longer the user's latest play: pending pauses are
+# per worker, so a newer track started by another worker must not be cut off by this one.
+def schedule_pause(user_id, target_device_id, stop_time_ms, play_id):
+    key = (user_id, target_device_id)
+
+    def stop_playback():
+        if user_state.current_play(user_id) != play_id:
+            logger.info("Auto-pause skipped for a newer play", extra={"user_id": user_id})
+            return
+        try:
+            user_call(
+                user_id,
+                lambda access_token: spotify_client.api_put(
+                    "/me/player/pause", access_token, params={"device_id": target_device_id}
+                ),
+            )
+        except Throttled as e:
+            scheduler.schedule(key, e.retry_after, stop_playback, replace=False)
+        except (requests.RequestException, TokenUnavailable) as e:
+            logger.warning("Auto-pause failed", extra={"user_id": user_id, "error": str(e)})
+
+    return scheduler.schedule(key, stop_time_ms / 1000, stop_playback)
+
+
+# Play the track for one run outcome and schedule its auto-pause.
+# error_code is None for a successful run. Returns a (body, http_status) pair.
+# The event is admitted once against the rate budgets, waiting until admit_deadline
+# (time.monotonic()) for budget if one is given; its auto-pause is not charged.
+def play_event(user_id, error_code=None, device_hint=None, admit_deadline=None):
+    if not token_store.get(user_id):
+        return {"error": f"No tokens found for user {user_id}"}, 401
+
+    if not token_manager.get_access_token(user_id):
+        return {"error": "No valid access token available"}, 401
+
+    if error_code is None:
+        track = track_registry.success_track(user_id)
+    else:
+        track = track_registry.error_track(error_code, user_id)
+
+    try:
+        with rate_governor.admitted(user_id, admit_deadline):
+            target_device_id, response, error = play_on_device(
+                user_id, track.track_uri, track.start_position_ms, device_hint
+            )
+    except TokenUnavailable:
+        return {"error": "No valid access token available"}, 401
+    except Throttled as e:
+        return throttled_body(e)
+    except requests.RequestException as e:
+        return {"error": "Failed to reach Spotify", "details": str(e)}, 502
+
+    if error:
+        return error
+
+    if response.status_code == 204:
+        schedule_pause(user_id, target_device_id, track.stop_time_ms, user_state.start_play(user_id))
+        if error_code is None:
+            message = f"Success track playing for user {user_id}"
+        else:
+            message = f"Error track playing for user {user_id} and error {error_code}"
+        return {"message": message, "device_id": target_device_id}, 200
     else:
-        return jsonify({"error": "Failed to play success track", "details": response.json()}), 500
+        kind = "success" if error_code is None else "error"
+        return {"error": f"Failed to play {kind} track", "details": error_details(response)}, 500
 
 
-@app.route('/vscode/error/<error_code>', methods=['POST'])
-def handle_error_event(error_code):
+# Async events are queued and coalesced per worker process; their statuses live next to the
+# tokens, so GET /vscode/events/<id> works whichever worker answers it
+# Queued events are in the background already, so they wait a little for rate budget
+EVENT_ADMIT_WAIT = float(os.getenv("EVENT_ADMIT_WAIT", "5"))
+
+
+def play_queued_event(user_id, error_code=None, device_hint=None):
+    return play_event(user_id, error_code, device_hint, admit_deadline=time.monotonic() + EVENT_ADMIT_WAIT)
+
+
+event_queue = EventQueue(
+    play_queued_event,
+    workers=int(os.getenv("EVENT_WORKERS", "4")),
+    max_pending=int(os.getenv("EVENT_QUEUE_SIZE", "1000")),
+    statuses=create_event_statuses(TOKEN_STORE, TOKEN_DB),
+)
+metrics.QUEUED_EVENTS.set_function(event_queue.pending)
+
+
+# Validate a play request, then either play it now or queue it when async was requested
+def dispatch_event(error_code=None):
     data = request.json
     user_id = data.get("user_id")
     if not user_id:
         return jsonify({"error": "User ID is missing"}), 400
 
-    user_tokens = tokens.get(user_id)
-    if not user_tokens:
+    if not token_store.get(user_id):
         return jsonify({"error": f"No tokens found for user {user_id}"}), 401
 
-    access_token = user_tokens.get("access_token")
-    if not access_token:
-        access_token = refresh_access_token(user_id)
-        if not access_token:
-            return jsonify({"error": "No valid access token available"}), 401
-
-    track_mapping = {
-        "syntax_error": {"track_uri": "spotify:track:0ee3MUsiFe6mETk4oBgPoG", "start_position_ms": 10000, "stop_time_ms": 24000},
-        "name_error": {"track_uri": "spotify:track:59OkvZEB9zPsEa6fQL2LlZ", "start_position_ms": 0, "stop_time_ms": 8000},
-        "type_error": {"track_uri": "spotify:track:1VsTvfmPwrJxIP5idldxX7", "start_position_ms": 0, "stop_time_ms": 12000},
-        "index_error": {"track_uri": "spotify:track:2mlGPkAx4kwF8Df0GlScsC", "start_position_ms": 16000, "stop_time_ms": 16000},
-        "key_error": {"track_uri": "spotify:track:4uLU6hMCjMI75M1A2tKUQC", "start_position_ms": 1000, "stop_time_ms": 18000},
-        "unknown_error": {"track_uri": "spotify:track:5QIQWDc5c20Sn5sEUwsqdU", "start_position_ms": 0, "stop_time_ms": 3000}
-    }
+    # Drop events while Spotify has this user cooling down instead of forwarding them
+    remaining = rate_governor.cooldown_remaining(user_id)
+    if remaining:
+        return json_response(*throttled_body(RateLimited("Spotify asked us to slow down for this user", remaining)))
 
-    track_data = track_mapping.get(error_code, track_mapping["unknown_error"])
-    track_uri = track_data["track_uri"]
-    start_position_ms = track_data["start_position_ms"]
-    stop_time_ms = track_data["stop_time_ms"]
+    if not data.get("async", ASYNC_EVENTS):
+        return json_response(*play_event(user_id, error_code, data.get("device_id")))
 
-    devices_url = "https://api.spotify.com/v1/me/player/devices"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    devices_response = requests.get(devices_url, headers=headers)
+    try:
+        event_id = event_queue.submit(user_id, error_code, data.get("device_id"))
+    except QueueFull:
+        metrics.THROTTLED.inc(reason="QueueFull")
+        return json_response({"error": "Too many queued events, try again shortly", "retry_after": 1}, 503)
+    return jsonify({"event_id": event_id, "status": "queued"}), 202
 
-    if devices_response.status_code != 200:
-        return jsonify({"error": "Failed to fetch devices", "details": devices_response.json()}), 500
 
-    devices = devices_response.json().get("devices", [])
-    if not devices:
-        return jsonify({"error": "No active devices found for the user"}), 404
+@app.route('/vscode/success', methods=['POST'])
+def handle_success_event():
+    return dispatch_event()
 
-    target_device_id = devices[0]["id"]
 
-    play_url = "https://api.spotify.com/v1/me/player/play"
-    payload = {
-        "uris": [track_uri],
-        "device_id": target_device_id,
-        "position_ms": start_position_ms
+# Pick the error track from raw output when the client sends it; the error_code in the
+# path is the client's own guess and only used when the output is not recognised
+def resolve_error_code(error_code, output):
+    if isinstance(output, str) and output:
+        classified = classifier.classify(output).error_code
+        if classified != "unknown_error":
+            return classified
+    return error_code
+
+
+@app.route('/vscode/error/<error_code>', methods=['POST'])
+def handle_error_event(error_code):
+    data = request.json or {}
+    return dispatch_event(resolve_error_code(error_code, data.get("output")))
+
+
+@app.route('/vscode/classify', methods=['POST'])
+def classify_output():
+    data = request.json or {}
+    output = data.get("output")
+    if not isinstance(output, str):
+        return jsonify({"error": "Output is missing"}), 400
+    error_code, matched = classifier.classify(output)
+    return jsonify({"error_code": error_code, "matched": matched})
+
+
+@app.route('/vscode/events/<event_id>', methods=['GET'])
+def event_status(event_id):
+    status = event_queue.status(event_id)
+    if not status:
+        return jsonify({"error": f"Unknown event {event_id}"}), 404
+    return jsonify(status)
+
+
+_batch_pool = None
+_batch_pool_pid = None
+_batch_pool_lock = Lock()
+
+
+# Shared pool for sync batch plays, rebuilt after a fork
+def batch_pool():
+    global _batch_pool, _batch_pool_pid
+    with _batch_pool_lock:
+        if _batch_pool_pid != os.getpid():
+            _batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch-play")
+            _batch_pool_pid = os.getpid()
+        return _batch_pool
+
+
+# Play several users' events at once, each waiting for rate budget until the time limit.
+# Events still waiting when it hits are cancelled; ones already talking to Spotify finish in
+# the background.
+def play_events_parallel(plays, results):
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    futures = {
+        batch_pool().submit(play_event, *args, admit_deadline=deadline): index for index, args in plays.items()
     }
-    response = requests.put(play_url, headers=headers, json=payload)
+    done, not_done = wait(futures, timeout=BATCH_TIMEOUT)
+    for future in done:
+        try:
+            body, status = future.result()
+        except Exception as e:
+            logger.exception("Batch event failed")
+            body, status = {"error": "Event failed", "details": str(e)}, 500
+        results[futures[future]] = {"status": "played" if status == 200 else "failed", "http_status": status,
+                                    "result": body}
+    for future in not_done:
+        if future.cancel():
+            results[futures[future]] = {"status": "rejected", "error": "Batch timed out before this event ran",
+                                        "retry_after": 1}
+        else:
+            results[futures[future]] = {"status": "timed_out", "error": "Batch timed out while this event was playing"}
 
-    if response.status_code == 204:
-        global active_timer
-        with lock:
-            if active_timer:
-                active_timer.cancel()
 
-        def stop_playback():
-            stop_url = "https://api.spotify.com/v1/me/player/pause"
-            requests.put(stop_url, headers=headers, params={"device_id": target_device_id})
+# Apply a batch of run outcomes, e.g. from a CI hook: {"events": [{user_id, outcome,
+# error_code, output, timestamp}, ...], "reduce": "last" | "error_wins", "async": bool}.
+# Each user's outcomes collapse to one play; every item gets its own status.
+@app.route('/vscode/events', methods=['POST'])
+def handle_event_batch():
+    data = request.json
+    records = data if isinstance(data, list) else (data or {}).get("events")
+    options = data if isinstance(data, dict) else {}
+    if not isinstance(records, list) or not records:
+        return jsonify({"error": "Events are missing"}), 400
+    if len(records) > BATCH_MAX_EVENTS:
+        return jsonify({"error": f"At most {BATCH_MAX_EVENTS} events per batch"}), 413
+
+    try:
+        chosen, rejected = reduce_batch(records, options.get("reduce", "last"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results = [None] * len(records)
+    for index, reason in rejected.items():
+        results[index] = {"status": "rejected", "error": reason}
+
+    run_async = options.get("async", ASYNC_EVENTS)
+    plays = {}
+    for user_id, index in chosen.items():
+        record = records[index]
+        error_code = None
+        if record["outcome"] == "error":
+            error_code = resolve_error_code(str(record.get("error_code") or "unknown_error"), record.get("output"))
+        remaining = rate_governor.cooldown_remaining(user_id)
+        if not token_store.get(user_id):
+            results[index] = {"status": "rejected", "error": f"No tokens found for user {user_id}"}
+        elif remaining:
+            metrics.THROTTLED.inc(reason="RateLimited")
+            results[index] = {"status": "rate_limited", "retry_after": math.ceil(remaining)}
+        elif run_async:
+            try:
+                event_id = event_queue.submit(user_id, error_code, record.get("device_id"))
+                results[index] = {"status": "queued", "event_id": event_id}
+            except QueueFull:
+                metrics.THROTTLED.inc(reason="QueueFull")
+                results[index] = {"status": "rejected", "error": "Too many queued events, try again shortly",
+                                  "retry_after": 1}
+        else:
+            plays[index] = (user_id, error_code, record.get("device_id"))
+
+    if plays:
+        play_events_parallel(plays, results)
 
-        with lock:
-            active_timer = Timer(stop_time_ms / 1000, stop_playback)
-            active_timer.start()
+    # Everything else was folded into its user's chosen event
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = {"status": "coalesced", "applied_index": chosen[records[index]["user_id"]]}
 
-        return jsonify({"message": f"Error track playing for user {user_id} and error {error_code}"})
-    else:
-        return jsonify({"error": "Failed to play error track", "details": response.json()}), 500
+    return jsonify({"results": results}), 202 if run_async else 200
 
 
 @app.route('/vscode/stop', methods=['POST'])
@@ -293,26 +627,31 @@ def stop_playback():
     if not user_id:
         return jsonify({"error": "User ID is missing"}), 400
 
-    user_tokens = tokens.get(user_id)
+    user_tokens = token_store.get(user_id)
     if not user_tokens:
         return jsonify({"error": f"No tokens found for user {user_id}"}), 401
 
-    access_token = user_tokens.get("access_token")
-    if not access_token:
-        access_token = refresh_access_token(user_id)
-        if not access_token:
-            return jsonify({"error": "No valid access token available"}), 401
-
-    stop_url = "https://api.spotify.com/v1/me/player/pause"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.put(stop_url, headers=headers)
+    if not token_manager.get_access_token(user_id):
+        return jsonify({"error": "No valid access token available"}), 401
+
+    try:
+        with rate_governor.admitted(user_id):
+            response = user_call(
+                user_id, lambda access_token: spotify_client.api_put("/me/player/pause", access_token)
+            )
+    except TokenUnavailable:
+        return jsonify({"error": "No valid access token available"}), 401
+    except Throttled as e:
+        return json_response(*throttled_body(e))
+    except requests.RequestException as e:
+        return jsonify({"error": "Failed to reach Spotify", "details": str(e)}), 502
 
     if response.status_code in [200, 204]:
+        scheduler.cancel_user(user_id)
         return jsonify({"message": f"Playback stopped for user {user_id}"})
     else:
-        return jsonify({"error": "Failed to stop playback", "details": response.json()}), 500
+        return jsonify({"error": "Failed to stop playback", "details": error_details(response)}), 500
 
 
 if __name__ == '__main__':
-    load_tokens()
-    app.run(debug=True)
+    create_app(warm=True).run(debug=True)
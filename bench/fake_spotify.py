@@ -0,0 +1,237 @@
+# Local stand-in for the Spotify endpoints app.py uses, for load testing without touching
+# the real API. Point the app at it with
+#   SPOTIFY_API_BASE=http://127.0.0.1:<port>/v1 SPOTIFY_ACCOUNTS_BASE=http://127.0.0.1:<port>
+#
+#   python bench/fake_spotify.py --port 8900 --latency-ms 40 --error-rate 0.01 --rate-429 0.01
+#
+# GET /_stats returns per-endpoint call counts, POST /_reset clears them.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class FakeSpotifyConfig:
+    def __init__(self, latency_ms=30, jitter_ms=10, error_rate=0.0, rate_401=0.0, rate_429=0.0,
+                 rate_404=0.0, retry_after=1, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_401 = rate_401
+        self.rate_429 = rate_429
+        self.rate_404 = rate_404
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def roll(self, rate):
+        if rate <= 0:
+            return False
+        with self.random_lock:
+            return self.random.random() < rate
+
+    def delay(self):
+        with self.random_lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeSpotifyHandler)
+        self.config = config
+        self.calls = Counter()
+        self.statuses = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, status):
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.statuses[f"{endpoint} {status}"] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "statuses": dict(self.statuses),
+                "total": sum(self.calls.values()),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.statuses.clear()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, endpoint, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        # Counted before the reply goes out, so a caller sees its own calls in stats()
+        self.server.record(endpoint, status)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    # Injected failures shared by every Spotify endpoint
+    def _injected(self, endpoint, authenticated=True):
+        config = self.server.config
+        if config.roll(config.rate_429):
+            self._send(endpoint, 429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                       {"Retry-After": str(config.retry_after)})
+            return True
+        if config.roll(config.error_rate):
+            self._send(endpoint, 503, {"error": {"status": 503, "message": "Service unavailable"}})
+            return True
+        if authenticated:
+            if not self.headers.get("Authorization", "").startswith("Bearer "):
+                self._send(endpoint, 401, {"error": {"status": 401, "message": "No token provided"}})
+                return True
+            if config.roll(config.rate_401):
+                self._send(endpoint, 401, {"error": {"status": 401, "message": "The access token expired"}})
+                return True
+        return False
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/_stats":
+            body = json.dumps(self.server.stats()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.server.config.delay()
+        if path == "/v1/me":
+            if not self._injected("me"):
+                self._send("me", 200, {"id": "bench-user"})
+        elif path == "/v1/me/player/devices":
+            if not self._injected("devices"):
+                self._send("devices", 200, {"devices": [{"id": "bench-device", "is_active": True}]})
+        else:
+            self._send("unknown", 404, {"error": {"status": 404, "message": "Not found"}})
+
+    # Connection warm-up probes; answered without closing the connection
+    def do_HEAD(self):
+        self.server.record("head", 404)
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        path = urlsplit(self.path).path
+        self._read_body()
+        self.server.config.delay()
+        if path == "/v1/me/player/play":
+            if self._injected("play"):
+                return
+            if self.server.config.roll(self.server.config.rate_404):
+                self._send("play", 404, {"error": {"status": 404, "message": "Player command failed: No active device found",
+                                                   "reason": "NO_ACTIVE_DEVICE"}})
+            else:
+                self._send("play", 204)
+        elif path == "/v1/me/player/pause":
+            if not self._injected("pause"):
+                self._send("pause", 204)
+        else:
+            self._send("unknown", 404, {"error": {"status": 404, "message": "Not found"}})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        self._read_body()
+        if path == "/_reset":
+            self.server.reset()
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.server.config.delay()
+        if path == "/api/token":
+            if not self._injected("token", authenticated=False):
+                self._send("token", 200, {
+                    "access_token": f"fake-{uuid.uuid4().hex}",
+                    "token_type": "Bearer",
+                    "expires_in": 3600,
+                    "refresh_token": "fake-refresh",
+                })
+        else:
+            self._send("unknown", 404, {"error": {"status": 404, "message": "Not found"}})
+
+
+# Start a fake server on a background thread; port 0 picks a free port
+def start_fake_spotify(config=None, host="127.0.0.1", port=0):
+    server = FakeSpotifyServer((host, port), config or FakeSpotifyConfig())
+    threading.Thread(target=server.serve_forever, name="fake-spotify", daemon=True).start()
+    return server
+
+
+def add_fault_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=30, help="mean upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="uniform latency jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--rate-401", type=float, default=0.0, help="fraction of API calls answered with 401")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--rate-404", type=float, default=0.0, help="fraction of plays answered NO_ACTIVE_DEVICE")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for fault injection")
+
+
+def config_from_args(args):
+    return FakeSpotifyConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_401=args.rate_401,
+        rate_429=args.rate_429,
+        rate_404=args.rate_404,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake of the Spotify API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeSpotifyServer((args.host, args.port), config_from_args(args))
+    print(f"Fake Spotify listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# Offline load test for app.py against the local fake Spotify in fake_spotify.py.
+#
+# Starts the fake, seeds a throwaway token database with simulated users, boots the app
+# under each requested server configuration, drives /vscode/success, /vscode/error/<code>
+# and /vscode/stop concurrently, and prints the results as JSON.
+#
+#   python bench/run_bench.py --servers dev,gunicorn:1x1,gunicorn:2x4 --users 50 \
+#       --events-per-user 20 --latency-ms 40 --rate-429 0.01 --out bench_output.json
+#
+# With --baseline previous.json the run exits non-zero when throughput drops or p95
+# latency grows by more than --tolerance for any server configuration.
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from fake_spotify import add_fault_arguments, config_from_args, start_fake_spotify
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from token_store import SQLiteTokenStore  # noqa: E402
+
+ERROR_CODES = ["syntax_error", "name_error", "type_error", "index_error", "key_error", "unknown_error"]
+
+
+# "dev" or "gunicorn:<workers>x<threads>"
+def parse_server_spec(spec):
+    if spec == "dev":
+        return {"label": "dev", "server": "dev", "workers": 1, "threads": None}
+    kind, _, shape = spec.partition(":")
+    if kind != "gunicorn":
+        raise ValueError(f"Unknown server spec: {spec}")
+    workers, _, threads = (shape or "1x1").partition("x")
+    workers, threads = int(workers), int(threads or 1)
+    return {"label": f"gunicorn:{workers}x{threads}", "server": "gunicorn", "workers": workers, "threads": threads}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_tokens(db_path, user_ids):
+    store = SQLiteTokenStore(str(db_path))
+    expires_at = time.time() + 3600
+    store.import_records({
+        user_id: {"access_token": f"seed-{user_id}", "refresh_token": "fake-refresh", "expires_at": expires_at}
+        for user_id in user_ids
+    })
+
+
+def start_app(spec, port, env, workdir):
+    if spec["server"] == "dev":
+        command = [
+            sys.executable, "-c",
+            f"import app; app.create_app(warm=True).run(host='127.0.0.1', port={port}, threaded=True, debug=False)",
+        ]
+    else:
+        command = [
+            sys.executable, "-m", "gunicorn",
+            "--config", str(ROOT / "gunicorn.conf.py"),
+            "--pythonpath", str(ROOT),
+            "--workers", str(spec["workers"]),
+            "--threads", str(spec["threads"]),
+            "--bind", f"127.0.0.1:{port}",
+            "--log-level", "warning",
+        ]
+    # The app logs to stderr; a file never fills up and stalls its log listener like a pipe would
+    with open(Path(workdir) / "app.log", "wb") as log:
+        return subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=log)
+
+
+def wait_ready(base_url, proc, workdir, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            log = (Path(workdir) / "app.log").read_text(errors="replace")
+            raise RuntimeError(f"App exited during startup: {log}")
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("App did not become ready in time")
+
+
+# pid plus all of its descendants, found through /proc (Linux only)
+def process_tree(root_pid):
+    parents = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        parents[ppid].append(int(entry))
+
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(parents.get(pid, []))
+    return pids
+
+
+def sample_processes(root_pid):
+    sample = {"processes": 0, "threads": 0, "rss_kb": 0}
+    if not os.path.isdir("/proc"):
+        return sample
+    for pid in process_tree(root_pid):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        sample["processes"] += 1
+        sample["threads"] += int(fields.get("Threads", "0").strip())
+        sample["rss_kb"] += int(fields.get("VmRSS", "0 kB").split()[0])
+    return sample
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+# One simulated developer: a keep-alive session firing events back to back
+def simulate_user(base_url, user_id, events, mix, use_async, seed):
+    rng = random.Random(seed)
+    samples = []
+    with requests.Session() as session:
+        for _ in range(events):
+            roll = rng.random()
+            body = {"user_id": user_id}
+            if use_async:
+                body["async"] = True
+            if roll < mix["stop"]:
+                route, path = "stop", "/vscode/stop"
+                body.pop("async", None)
+            elif roll < mix["stop"] + mix["error"]:
+                route, path = "error", f"/vscode/error/{rng.choice(ERROR_CODES)}"
+            else:
+                route, path = "success", "/vscode/success"
+
+            started = time.perf_counter()
+            try:
+                status = session.post(f"{base_url}{path}", json=body, timeout=30).status_code
+            except requests.RequestException:
+                status = "exception"
+            samples.append((route, status, (time.perf_counter() - started) * 1000))
+    return samples
+
+
+def run_one(spec, args, fake, user_ids):
+    workdir = tempfile.mkdtemp(prefix="bugbeats-bench-")
+    db_path = Path(workdir) / "tokens.db"
+    seed_tokens(db_path, user_ids)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ)
+    env.update({
+        "SPOTIFY_API_BASE": f"{fake.base_url}/v1",
+        "SPOTIFY_ACCOUNTS_BASE": fake.base_url,
+        "SPOTIFY_CLIENT_ID": "bench",
+        "SPOTIFY_CLIENT_SECRET": "bench",
+        "SPOTIFY_REDIRECT_URI": f"{base_url}/callback",
+        "TOKEN_STORE": "sqlite",
+        "TOKEN_DB": str(db_path),
+        "METRICS_DIR": str(Path(workdir) / "metrics"),
+        # Measure the server, not the rate governor's budgets
+        "SPOTIFY_GLOBAL_RATE": os.environ.get("SPOTIFY_GLOBAL_RATE", "100000"),
+        "SPOTIFY_GLOBAL_BURST": os.environ.get("SPOTIFY_GLOBAL_BURST", "100000"),
+        "SPOTIFY_USER_RATE": os.environ.get("SPOTIFY_USER_RATE", "1000"),
+        "SPOTIFY_USER_BURST": os.environ.get("SPOTIFY_USER_BURST", "1000"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")])),
+    })
+
+    proc = start_app(spec, port, env, workdir)
+    try:
+        wait_ready(base_url, proc, workdir)
+        before = sample_processes(proc.pid)
+        fake.reset()
+
+        mix = {"success": args.success_ratio, "error": args.error_ratio, "stop": args.stop_ratio}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [
+                pool.submit(simulate_user, base_url, user_id, args.events_per_user, mix, args.use_async, args.seed + i)
+                for i, user_id in enumerate(user_ids)
+            ]
+            samples = [sample for future in futures for sample in future.result()]
+        elapsed = time.perf_counter() - started
+
+        after = sample_processes(proc.pid)
+        upstream_at_response = fake.stats()
+        time.sleep(args.settle)
+        settled = sample_processes(proc.pid)
+        upstream = fake.stats()
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    by_route = defaultdict(list)
+    statuses = Counter()
+    for route, status, latency in samples:
+        by_route[route].append(latency)
+        statuses[f"{route} {status}"] += 1
+
+    total = len(samples)
+    errors = sum(count for key, count in statuses.items() if not key.endswith((" 200", " 202")))
+    return {
+        "label": spec["label"],
+        "server": spec["server"],
+        "workers": spec["workers"],
+        "threads": spec["threads"],
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "overall": summarize([latency for _, _, latency in samples]),
+            **{route: summarize(values) for route, values in sorted(by_route.items())},
+        },
+        "status_codes": dict(sorted(statuses.items())),
+        "upstream": {
+            "calls_per_event": round(upstream["total"] / total, 3) if total else None,
+            "calls_per_event_at_response": round(upstream_at_response["total"] / total, 3) if total else None,
+            "calls": upstream["calls"],
+            "statuses": upstream["statuses"],
+        },
+        "process": {
+            "before": before,
+            "after": after,
+            "settled": settled,
+            "thread_growth": after["threads"] - before["threads"],
+            "rss_growth_kb": settled["rss_kb"] - before["rss_kb"],
+        },
+    }
+
+
+# Compare against a previous result file; returns human-readable regressions
+def find_regressions(runs, baseline, tolerance):
+    previous = {run["label"]: run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in runs:
+        old = previous.get(run["label"])
+        if not old:
+            continue
+        if old.get("throughput_rps") and run["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{run['label']}: throughput {run['throughput_rps']} < {old['throughput_rps']} rps")
+        old_p95 = old["latency_ms"]["overall"].get("p95")
+        new_p95 = run["latency_ms"]["overall"].get("p95")
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{run['label']}: p95 {new_p95} > {old_p95} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test app.py against a local fake Spotify")
+    parser.add_argument("--servers", default="dev,gunicorn:1x1,gunicorn:2x4",
+                        help="comma-separated server configs: dev, gunicorn:<workers>x<threads>")
+    parser.add_argument("--users", type=int, default=20, help="simulated users")
+    parser.add_argument("--events-per-user", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=None, help="users driven at once (default: all)")
+    parser.add_argument("--success-ratio", type=float, default=0.45)
+    parser.add_argument("--error-ratio", type=float, default=0.45)
+    parser.add_argument("--stop-ratio", type=float, default=0.10)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="send events with async: true")
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to wait for background work after load")
+    parser.add_argument("--out", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="previous JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    args.concurrency = args.concurrency or args.users
+    if args.seed is None:
+        args.seed = 0
+
+    fake = start_fake_spotify(config_from_args(args))
+    user_ids = [f"bench-user-{i}" for i in range(args.users)]
+    runs = []
+    for spec in args.servers.split(","):
+        runs.append(run_one(parse_server_spec(spec.strip()), args, fake, user_ids))
+    fake.shutdown()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "load": {
+            "users": args.users,
+            "events_per_user": args.events_per_user,
+            "concurrency": args.concurrency,
+            "async": args.use_async,
+            "mix": {"success": args.success_ratio, "error": args.error_ratio, "stop": args.stop_ratio},
+        },
+        "fake_spotify": {
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "rate_401": args.rate_401,
+            "rate_429": args.rate_429,
+            "rate_404": args.rate_404,
+        },
+        "runs": runs,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(runs, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
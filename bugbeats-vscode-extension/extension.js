@@ -5,6 +5,7 @@ const axios = require('axios');
 const FLASK_API_URL = 'https://bug-beats-5b49ab3807c5.herokuapp.com/';
 
 let userId = null; // Store the logged-in Spotify user ID
+let deviceId = null; // Last device the server played on, sent back as a hint
 let outputChannel = null; // Output channel for messages and debugging
 
 /**
@@ -69,8 +70,8 @@ function activate(context) {
             console.log(`Detected Error Code: ${errorCode}`);
             displayMessage(`Error detected (${errorCode}):\n${error.message}`, "error");
 
-            // Trigger an error-specific track via Flask API
-            await triggerErrorTrack(errorCode, userId);
+            // Trigger an error-specific track via Flask API; the server classifies the raw output
+            await triggerErrorTrack(errorCode, userId, error.message);
         }
     });
 
@@ -151,19 +152,21 @@ function executeFile(filePath, language) {
 async function triggerPlaylist(endpoint, userId) {
     try {
         const url = `${FLASK_API_URL}${endpoint}`;
-        const response = await axios.post(url, { user_id: userId });
+        const response = await axios.post(url, { user_id: userId, device_id: deviceId });
         console.log('Playlist Triggered:', response.data);
+        deviceId = response.data.device_id || null;
     } catch (error) {
         console.error('Failed to trigger playlist:', error.message);
     }
 }
 
 // Function to trigger error-specific track
-async function triggerErrorTrack(errorCode, userId) {
+async function triggerErrorTrack(errorCode, userId, output) {
     try {
         const url = `${FLASK_API_URL}vscode/error/${errorCode}`;
-        const response = await axios.post(url, { user_id: userId });
+        const response = await axios.post(url, { user_id: userId, device_id: deviceId, output });
         console.log('Error Track Triggered:', response.data);
+        deviceId = response.data.device_id || null;
     } catch (error) {
         console.error('Failed to trigger error track:', error.message);
     }
@@ -181,7 +184,7 @@ async function stopPlayback(userId) {
     }
 }
 
-// Function to map error messages to error codes
+// Function to map error messages to error codes (fallback when the server can't classify)
 function getErrorCode(errorMessage) {
     if (errorMessage.includes('SyntaxError')) return 'syntax_error';
     if (errorMessage.includes('NameError')) return 'name_error';
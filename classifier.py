@@ -0,0 +1,89 @@
+import re
+from collections import namedtuple
+
+Classification = namedtuple("Classification", "error_code matched")
+
+UNKNOWN = Classification("unknown_error", None)
+
+# (error_code, source, phrases); source only documents where the phrases come from.
+# Phrases are plain text, not regexes, so the compiled matcher never backtracks.
+# Every error_code must have a track under "errors" in tracks.json; errors without a fitting
+# kind (stack overflows, segfaults) are left out and classify as unknown_error.
+RULES = [
+    # Python
+    ("syntax_error", "python", ["SyntaxError", "IndentationError", "TabError"]),
+    ("name_error", "python", ["NameError", "UnboundLocalError", "ModuleNotFoundError", "ImportError"]),
+    ("type_error", "python", ["TypeError", "AttributeError", "ValueError", "ZeroDivisionError"]),
+    ("index_error", "python", ["IndexError"]),
+    ("key_error", "python", ["KeyError"]),
+    # Node
+    ("name_error", "node", ["ReferenceError"]),
+    ("index_error", "node", ["RangeError"]),
+    ("name_error", "node", ["Cannot find module"]),
+    # Java
+    ("index_error", "java", [
+        "ArrayIndexOutOfBoundsException", "StringIndexOutOfBoundsException", "IndexOutOfBoundsException",
+    ]),
+    ("type_error", "java", ["ClassCastException", "NumberFormatException", "incompatible types",
+                            "NullPointerException", "ArithmeticException: / by zero"]),
+    ("name_error", "java", ["cannot find symbol", "ClassNotFoundException"]),
+    ("key_error", "java", ["NoSuchElementException"]),
+    ("syntax_error", "java", ["error: ';' expected", "error: class, interface, or enum expected",
+                              "error: illegal start of expression", "error: reached end of file while parsing"]),
+    # gcc / g++
+    ("syntax_error", "c", ["error: expected"]),
+    ("name_error", "c", ["was not declared in this scope", "undeclared (first use in this function)",
+                         "undefined reference to", "No such file or directory"]),
+    ("type_error", "c", ["invalid conversion from", "incompatible type", "cannot convert"]),
+    # bash
+    ("syntax_error", "bash", ["syntax error near unexpected token", "unexpected end of file", "bad substitution"]),
+    ("name_error", "bash", ["command not found", "unbound variable"]),
+    ("index_error", "bash", ["bad array subscript"]),
+]
+
+
+# Fold the phrases into a prefix trie and emit it as one regex. Alternatives at every node
+# start with distinct characters, so each position of the output costs a single failed
+# character test in the common case and the whole scan stays linear in the output size.
+def _compile(phrases):
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return re.compile(emit(trie))
+
+
+# Classifies raw stderr / tracebacks from a compiled rule set
+class ErrorClassifier:
+    def __init__(self, rules=RULES):
+        self.rules = tuple(rules)
+        self._codes = {}
+        for error_code, _, phrases in self.rules:
+            for phrase in phrases:
+                self._codes.setdefault(phrase, error_code)
+        self._pattern = _compile(self._codes)
+
+    # The last recognised error wins: interpreters print the error that actually ended the
+    # run after any context (chained exceptions, earlier warnings, stack frames).
+    def classify(self, output):
+        if not output:
+            return UNKNOWN
+        last = None
+        for last in self._pattern.finditer(output):
+            pass
+        if last is None:
+            return UNKNOWN
+        return Classification(self._codes[last.group()], last.group())
+
+
+classifier = ErrorClassifier()
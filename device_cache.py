@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+# Per-user active device cache with TTL expiry and LRU eviction
+class DeviceCache:
+    def __init__(self, ttl=300, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            device_id, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return device_id
+
+    def set(self, user_id, device_id):
+        with self._lock:
+            self._entries[user_id] = (device_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
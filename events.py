@@ -0,0 +1,253 @@
+import itertools
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from threading import Condition, Lock, Thread
+
+from logging_setup import get_logger
+from sqlite_db import ProcessConnection
+
+logger = get_logger("events")
+
+
+# Raised when too many users already have events waiting
+class QueueFull(Exception):
+    pass
+
+
+# Event statuses kept in this process only; the most recent max_results are remembered.
+# Each write carries a sequence number and a write older than the stored one is ignored,
+# so statuses recorded from different threads cannot go backwards.
+class MemoryEventStatuses:
+    def __init__(self, max_results=10000):
+        self.max_results = max_results
+        self._results = OrderedDict()
+        self._lock = Lock()
+
+    def set(self, event_id, status, seq):
+        with self._lock:
+            current = self._results.get(event_id)
+            if current and current[0] >= seq:
+                return
+            self._results[event_id] = (seq, status)
+            self._results.move_to_end(event_id)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def get(self, event_id):
+        with self._lock:
+            current = self._results.get(event_id)
+        return current[1] if current else None
+
+    def close(self):
+        pass
+
+
+# Event statuses in a SQLite database shared by every worker, so any worker can answer for
+# an event another one queued. Rows older than max_age seconds are pruned as new ones land.
+class SQLiteEventStatuses:
+    def __init__(self, path, max_age=3600, prune_every=1000):
+        self.path = path
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self._writes = 0
+        self.db = ProcessConnection(
+            path,
+            [
+                "CREATE TABLE IF NOT EXISTS event_statuses ("
+                "event_id TEXT PRIMARY KEY, status TEXT NOT NULL, seq INTEGER NOT NULL, updated_at REAL NOT NULL)",
+            ],
+        )
+
+    # Ignored when the stored status has a newer sequence number
+    def set(self, event_id, status, seq):
+        now = time.time()
+        with self.db.lock:
+            conn = self.db.get()
+            conn.execute(
+                "INSERT INTO event_statuses (event_id, status, seq, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(event_id) DO UPDATE SET status = excluded.status, seq = excluded.seq, "
+                "updated_at = excluded.updated_at WHERE excluded.seq > event_statuses.seq",
+                (event_id, json.dumps(status), seq, now),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                conn.execute("DELETE FROM event_statuses WHERE updated_at < ?", (now - self.max_age,))
+
+    def get(self, event_id):
+        with self.db.lock:
+            row = self.db.get().execute("SELECT status FROM event_statuses WHERE event_id = ?", (event_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Close this process's connection; the next call reopens it
+    def close(self):
+        self.db.close()
+
+
+# Build the status store matching the token store ("sqlite" or "memory")
+def create_event_statuses(kind="sqlite", path="spotify_tokens.db"):
+    if kind == "memory":
+        return MemoryEventStatuses()
+    if kind == "sqlite":
+        return SQLiteEventStatuses(path)
+    raise ValueError(f"Unknown event status store: {kind}")
+
+
+# Background event processing with per-user coalescing. Each user has at most one waiting
+# event: a newer one replaces it (the older is reported as superseded), and a user's events
+# never run concurrently. handler(user_id, *args) returns a (body, http_status) pair.
+# Queues are per process: under several gunicorn workers coalescing and ordering only apply
+# to events that reach the same worker, while statuses can be shared through `statuses`.
+# Statuses are written outside the queue lock, numbered so that late writes never win, and
+# a failed write is logged without disturbing the queue.
+class EventQueue:
+    def __init__(self, handler, workers=4, max_pending=1000, statuses=None):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.statuses = statuses or MemoryEventStatuses()
+        self._pending = {}
+        self._ready = deque()
+        self._active = set()
+        self._seq = itertools.count(1)
+        self._cond = Condition()
+        self._threads = []
+        self._pid = None
+
+    # Start the worker pool lazily, and again in a forked child
+    def _ensure_workers(self):
+        if self._pid != os.getpid():
+            self._pending.clear()
+            self._ready.clear()
+            self._active.clear()
+            self._threads = []
+            self._pid = os.getpid()
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = Thread(target=self._run, name=f"event-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Take the sequence number while the state change it records is still current
+    def _status_update(self, event_id, status):
+        return event_id, status, next(self._seq)
+
+    def _write_status(self, event_id, status, seq):
+        try:
+            self.statuses.set(event_id, status, seq)
+        except Exception:
+            logger.exception("Failed to record event status", extra={"event_id": event_id, "status": status["status"]})
+
+    # Queue an event for user_id and return its id
+    def submit(self, user_id, *args):
+        with self._cond:
+            self._ensure_workers()
+            previous = self._pending.get(user_id)
+            if previous is None and len(self._pending) >= self.max_pending:
+                raise QueueFull(user_id)
+
+            event_id = uuid.uuid4().hex
+            updates = []
+            if previous:
+                updates.append(self._status_update(previous[0], {"status": "superseded", "superseded_by": event_id}))
+            self._pending[user_id] = (event_id, args)
+            updates.append(self._status_update(event_id, {"status": "queued"}))
+
+            if previous is None and user_id not in self._active:
+                self._ready.append(user_id)
+                self._cond.notify()
+
+        for update in updates:
+            self._write_status(*update)
+        return event_id
+
+    # Outcome of an event, or None if it is unknown or has aged out
+    def status(self, event_id):
+        status = self.statuses.get(event_id)
+        return dict(status, event_id=event_id) if status else None
+
+    # Number of users with an event waiting to run
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                user_id = self._ready.popleft()
+                event_id, args = self._pending.pop(user_id)
+                self._active.add(user_id)
+                running = self._status_update(event_id, {"status": "running"})
+
+            try:
+                self._write_status(*running)
+                try:
+                    body, http_status = self.handler(user_id, *args)
+                except Exception as e:
+                    body, http_status = {"error": "Event failed", "details": str(e)}, 500
+                done = {"status": "done", "http_status": http_status, "result": body}
+                self._write_status(*self._status_update(event_id, done))
+            finally:
+                with self._cond:
+                    self._active.discard(user_id)
+                    if user_id in self._pending:
+                        self._ready.append(user_id)
+                        self._cond.notify()
+
+
+# Seconds since the epoch for a numeric or ISO-8601 timestamp, None if absent
+def _timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("timestamp must be a number or ISO-8601 string")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    raise ValueError("timestamp must be a number or ISO-8601 string")
+
+
+# How a user's outcomes in one batch collapse to the one that is played:
+# "last" plays the newest outcome, "error_wins" plays the newest error if there was any.
+REDUCE_RULES = ("last", "error_wins")
+
+
+# Validate batch records and pick one record per user. Returns (chosen, rejected):
+# chosen maps user_id to the index of its winning record, rejected maps index to a reason.
+def reduce_batch(records, rule="last"):
+    if rule not in REDUCE_RULES:
+        raise ValueError(f"Unknown reduce rule: {rule}")
+
+    rejected = {}
+    by_user = {}
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            rejected[index] = "Event must be an object"
+            continue
+        if not record.get("user_id") or not isinstance(record["user_id"], str):
+            rejected[index] = "User ID is missing"
+            continue
+        if record.get("outcome") not in ("success", "error"):
+            rejected[index] = "Outcome must be 'success' or 'error'"
+            continue
+        try:
+            timestamp = _timestamp(record.get("timestamp"))
+        except ValueError as e:
+            rejected[index] = str(e)
+            continue
+        # Records without a timestamp keep their position in the batch
+        order = (timestamp if timestamp is not None else float("-inf"), index)
+        by_user.setdefault(record["user_id"], []).append((order, index, record["outcome"]))
+
+    chosen = {}
+    for user_id, entries in by_user.items():
+        if rule == "error_wins" and any(outcome == "error" for _, _, outcome in entries):
+            entries = [entry for entry in entries if entry[2] == "error"]
+        chosen[user_id] = max(entries)[1]
+    return chosen, rejected
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+# gunicorn -c gunicorn.conf.py; command-line flags still override these settings
+wsgi_app = "app:create_app()"
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers now and then; each replacement warms up before it takes traffic
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+# Import the app and load tokens once in the master, so workers fork with the token cache
+# already filled (shared copy-on-write). Code changes then need a full restart, not a HUP.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# Workers share metrics through snapshot files so /metrics covers all of them, whichever
+# worker answers. Give each app on a host its own directory.
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "bugbeats-metrics"))
+
+
+# Drop snapshots left over from a previous run before any worker starts
+def on_starting(server):
+    import metrics
+
+    metrics.clear_snapshots()
+
+
+# Runs in each freshly forked worker once the app is loaded (post_fork would run before the
+# import when preload_app is off) and before it accepts connections, so the first events
+# never pay for TLS handshakes. Threads, sockets and database connections are per process.
+def post_worker_init(worker):
+    import app
+
+    app.warm_up()
+
+
+# Keep an exited worker's counters in the totals without leaving its pid's file behind
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,67 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Field names that must never reach the log output
+_SECRET_MARKERS = ("token", "secret", "authorization", "password")
+
+_handler = QueueHandler(queue.SimpleQueue())
+_listener = None
+
+
+# One JSON object per line: time, level, logger, message and any extra fields
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key in _RESERVED or key.startswith("_"):
+                continue
+            if any(marker in key.lower() for marker in _SECRET_MARKERS):
+                value = "[redacted]"
+            entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Fresh queue and listener thread; also run in forked children, where neither survives
+def _start_listener():
+    global _listener
+    _handler.queue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter())
+    _listener = QueueListener(_handler.queue, stream)
+    _listener.start()
+
+
+# Route the "bugbeats" loggers through a queue so request threads never block on I/O;
+# a listener thread (restarted in forked workers) does the formatting and writing.
+def configure_logging(level=None):
+    logger = logging.getLogger("bugbeats")
+    if _handler in logger.handlers:
+        return logger
+    logger.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    logger.addHandler(_handler)
+    logger.propagate = False
+    _start_listener()
+    os.register_at_fork(after_in_child=_start_listener)
+    atexit.register(lambda: _listener.stop())
+    return logger
+
+
+def get_logger(name):
+    return logging.getLogger(f"bugbeats.{name}")
@@ -0,0 +1,342 @@
+import atexit
+import json
+import os
+import time
+from bisect import bisect_left
+from threading import Lock, Thread
+
+# Where each worker drops its latest snapshot so /metrics can sum across gunicorn workers.
+# Unset means single-process: /metrics reports only the process that serves it.
+METRICS_DIR = os.getenv("METRICS_DIR")
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._function = None
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    # Read the value from fn() whenever the gauge is collected
+    def set_function(self, fn):
+        self._function = fn
+
+    def samples(self):
+        if self._function is not None:
+            return {(): self._function()}
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    # Per-label state is [count per bucket..., count above the last bucket, sum]
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            state[index] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return {key: list(state) for key, state in self._values.items()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    # Values inherited from the parent would be double counted after a fork
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+    # JSON-serialisable view of every metric in this process
+    def snapshot(self):
+        snapshot = {}
+        for metric in self._metrics:
+            entry = {
+                "kind": metric.kind,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "samples": [[list(key), value] for key, value in metric.samples().items()],
+            }
+            if metric.kind == "histogram":
+                entry["buckets"] = list(metric.buckets)
+            snapshot[metric.name] = entry
+        return snapshot
+
+
+# Sum snapshots from several processes. Gauges only count processes that are still alive;
+# counters and histograms keep the totals of workers that have exited.
+def merge_snapshots(snapshots):
+    merged = {}
+    for snapshot, alive in snapshots:
+        for name, entry in snapshot.items():
+            if entry["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, dict(entry, samples={}))
+            for key, value in entry["samples"]:
+                key = tuple(key)
+                previous = target["samples"].get(key)
+                if previous is None:
+                    target["samples"][key] = value
+                elif entry["kind"] == "histogram":
+                    target["samples"][key] = [a + b for a, b in zip(previous, value)]
+                else:
+                    target["samples"][key] = previous + value
+    return merged
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Prometheus text exposition format (version 0.0.4)
+def render(merged):
+    lines = []
+    for name, entry in merged.items():
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        names = entry["labelnames"]
+        for key, value in sorted(entry["samples"].items()):
+            if entry["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(entry["buckets"], value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(names, key, [('le', _number(float(bound)))])} {cumulative}")
+            cumulative += value[-2]
+            lines.append(f"{name}_bucket{_labels(names, key, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, key)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(names, key)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Hot-path metrics
+REQUEST_LATENCY = REGISTRY.histogram(
+    "bugbeats_request_duration_seconds", "Request latency by route", ("route", "method", "status")
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("bugbeats_requests_in_flight", "Requests currently being served")
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "bugbeats_spotify_request_duration_seconds", "Spotify call latency by endpoint", ("endpoint", "method")
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "bugbeats_spotify_responses_total", "Spotify responses by endpoint and status", ("endpoint", "method", "status")
+)
+UPSTREAM_UNAUTHORIZED = REGISTRY.counter("bugbeats_spotify_unauthorized_total", "Spotify 401 responses")
+UPSTREAM_RATE_LIMITED = REGISTRY.counter("bugbeats_spotify_rate_limited_total", "Spotify 429 responses")
+TOKEN_REFRESHES = REGISTRY.counter("bugbeats_token_refreshes_total", "Access token refreshes", ("result",))
+DEVICE_LOOKUPS = REGISTRY.counter("bugbeats_device_lookups_total", "GET /me/player/devices lookups")
+DEVICE_CACHE = REGISTRY.counter("bugbeats_device_cache_total", "Device cache lookups", ("result",))
+PENDING_PAUSES = REGISTRY.gauge("bugbeats_pending_pauses", "Auto-pause jobs waiting to run")
+QUEUED_EVENTS = REGISTRY.gauge("bugbeats_queued_events", "Users with an async event waiting")
+ADMITTED_EVENTS = REGISTRY.gauge("bugbeats_admitted_events_in_flight", "Events admitted and still talking to Spotify")
+THROTTLED = REGISTRY.counter("bugbeats_throttled_total", "Events refused before reaching Spotify", ("reason",))
+
+
+_flusher = None
+_flusher_pid = None
+_flusher_lock = Lock()
+
+# Counters and histograms of workers that have exited, folded together by the gunicorn master
+ARCHIVE_FILE = "archived.json"
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Atomically replace this process's snapshot file
+def write_snapshot():
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(_snapshot_path(os.getpid()), REGISTRY.snapshot())
+
+
+# Remove every snapshot, e.g. from a previous run, before workers start
+def clear_snapshots():
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for filename in os.listdir(METRICS_DIR):
+        if filename.endswith((".json", ".tmp")):
+            os.remove(os.path.join(METRICS_DIR, filename))
+
+
+# Fold an exited worker's counters and histograms into the archive and delete its file, so
+# its totals survive and a later worker that reuses the pid starts from a clean file.
+# Gauges are dropped. Only the gunicorn master calls this, so the archive has one writer.
+def mark_process_dead(pid):
+    if not METRICS_DIR:
+        return
+    path = _snapshot_path(pid)
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+    snapshots = [(snapshot, False)]
+    archive = _read_json(archive_path)
+    if archive is not None:
+        snapshots.append((archive, False))
+    merged = merge_snapshots(snapshots)
+    for entry in merged.values():
+        entry["samples"] = [[list(key), value] for key, value in entry["samples"].items()]
+    _write_json(archive_path, merged)
+    os.remove(path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+# Keep this process's snapshot fresh so scrapes served by other workers include it
+def start_flusher():
+    global _flusher, _flusher_pid
+    if not METRICS_DIR:
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid() and _flusher.is_alive():
+            return
+        if _flusher_pid != os.getpid():
+            # Flush the final counts when a worker exits cleanly
+            atexit.register(write_snapshot)
+        _flusher = Thread(target=_flush_loop, name="metrics-flusher", daemon=True)
+        _flusher.start()
+        _flusher_pid = os.getpid()
+
+
+# Metrics for every worker, in Prometheus text format
+def collect():
+    if not METRICS_DIR:
+        return render(merge_snapshots([(REGISTRY.snapshot(), True)]))
+
+    start_flusher()
+    write_snapshot()
+    snapshots = []
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+        snapshot = _read_json(os.path.join(METRICS_DIR, filename))
+        if snapshot is None:
+            continue
+        name = filename[:-len(".json")]
+        snapshots.append((snapshot, name.isdigit() and _alive(int(name))))
+    return render(merge_snapshots(snapshots))
+
+
+os.register_at_fork(after_in_child=REGISTRY.reset)
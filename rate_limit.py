@@ -0,0 +1,178 @@
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+from logging_setup import get_logger
+
+logger = get_logger("rate_limit")
+
+# Raised instead of calling Spotify. wait is the exact delay in seconds before a retry can
+# succeed; retry_after rounds it up to a whole-second hint for the client.
+class Throttled(Exception):
+    status = 429
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.wait = retry_after
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+# The user or the app is out of budget, or Spotify asked us to back off
+class RateLimited(Throttled):
+    status = 429
+
+
+# Too many events already waiting on Spotify in this worker
+class Overloaded(Throttled):
+    status = 503
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Take one token; returns 0 on success or the seconds until one is available.
+    # Callers hold the governor lock.
+    def take(self, now):
+        # now may predate a bucket created under the same lock hold
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# Admission control in front of Spotify: a global bucket for the app's client credentials, a
+# bucket per user, per-user cool-downs from Retry-After, and a cap on events in flight.
+# Budgets are charged once per event, however many calls the event makes. Admission fails
+# fast unless the caller passes a deadline it is willing to wait until.
+# Budgets are per worker process, so size the global rate as the app budget / workers.
+# Cool-downs are shared with the other workers through `cooldowns` when one is given: a store
+# with start_cooldown(user_id, until) and cooldown_until(user_id), in time.time() seconds.
+# Each worker keeps a local copy of the cool-downs it has seen, so while none is running for
+# a user a check costs one read from the store.
+class RateGovernor:
+    def __init__(self, global_rate=20, global_burst=40, user_rate=2, user_burst=6,
+                 max_inflight=64, max_retry_after=120, max_users=10000, cooldowns=None):
+        self.cooldowns = cooldowns
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_inflight = max_inflight
+        self.max_retry_after = max_retry_after
+        self.max_users = max_users
+        self._global = TokenBucket(global_rate, global_burst)
+        self._users = OrderedDict()
+        self._cooldowns = {}
+        self._inflight = 0
+        self._lock = Lock()
+
+    def _user_bucket(self, user_id):
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._users[user_id] = bucket
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return bucket
+
+    # Seconds left in the user's cool-down, 0 if none; checking it costs no budget
+    def cooldown_remaining(self, user_id):
+        with self._lock:
+            until = self._cooldowns.get(user_id)
+            if until is not None:
+                remaining = until - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                del self._cooldowns[user_id]
+        if self.cooldowns is None:
+            return 0
+
+        try:
+            shared_until = self.cooldowns.cooldown_until(user_id)
+        except Exception as e:
+            logger.warning("Shared cool-down check failed", extra={"user_id": user_id, "error": str(e)})
+            return 0
+        remaining = shared_until - time.time() if shared_until else 0
+        if remaining <= 0:
+            return 0
+        with self._lock:
+            self._cooldowns[user_id] = max(time.monotonic() + remaining, self._cooldowns.get(user_id, 0))
+        return remaining
+
+    def check_cooldown(self, user_id):
+        remaining = self.cooldown_remaining(user_id)
+        if remaining:
+            raise RateLimited("Spotify asked us to slow down for this user", remaining)
+
+    # Reserve one event for user_id, or raise; pair every successful admit() with release().
+    # With a deadline (time.monotonic()), waits for budget as long as it can arrive in time.
+    def admit(self, user_id, deadline=None):
+        while True:
+            try:
+                self._admit(user_id)
+                return
+            except RateLimited as e:
+                if deadline is None or time.monotonic() + e.wait > deadline:
+                    raise
+                time.sleep(e.wait)
+
+    def _admit(self, user_id):
+        self.check_cooldown(user_id)
+
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                raise Overloaded("Too many events waiting on Spotify", 1)
+            now = time.monotonic()
+            # Check the user first so one noisy user cannot drain the shared bucket
+            user_bucket = self._user_bucket(user_id)
+            wait = user_bucket.take(now)
+            if wait:
+                raise RateLimited("Too many events for this user", wait)
+            wait = self._global.take(now)
+            if wait:
+                user_bucket.tokens += 1
+                raise RateLimited("Too many events for the app", wait)
+            self._inflight += 1
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+
+    @contextmanager
+    def admitted(self, user_id, deadline=None):
+        self.admit(user_id, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # Start a cool-down from a 429's Retry-After header; returns its length in seconds
+    def observe_rate_limit(self, user_id, retry_after_header):
+        try:
+            retry_after = float(retry_after_header)
+        except (TypeError, ValueError):
+            retry_after = 1
+        retry_after = min(max(retry_after, 1), self.max_retry_after)
+        with self._lock:
+            until = time.monotonic() + retry_after
+            self._cooldowns[user_id] = max(until, self._cooldowns.get(user_id, 0))
+        if self.cooldowns is not None:
+            try:
+                self.cooldowns.start_cooldown(user_id, time.time() + retry_after)
+            except Exception as e:
+                logger.warning("Failed to share cool-down", extra={"user_id": user_id, "error": str(e)})
+        return retry_after
+
+    def inflight(self):
+        with self._lock:
+            return self._inflight
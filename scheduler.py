@@ -0,0 +1,133 @@
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+
+from logging_setup import get_logger
+
+logger = get_logger("scheduler")
+
+
+# A scheduled call; cancel() is safe to call at any time, even after it ran
+class ScheduledJob:
+    __slots__ = ("scheduler", "key", "deadline", "fn", "cancelled")
+
+    def __init__(self, scheduler, key, deadline, fn):
+        self.scheduler = scheduler
+        self.key = key
+        self.deadline = deadline
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.scheduler._cancel_job(self)
+
+
+# Runs delayed playback jobs (auto-pause). One background thread waits for deadlines and
+# hands due jobs to a fixed pool, so a slow Spotify call for one user never delays another
+# user's pause. Jobs are keyed, typically by (user_id, device_id): scheduling a key again
+# replaces its pending job.
+class PlaybackScheduler:
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._executor = None
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._cond = Condition()
+        self._thread = None
+        self._pid = None
+
+    # Start the worker thread lazily, and again in a forked child (threads do not survive fork)
+    def _ensure_thread(self):
+        if self._pid != os.getpid():
+            self._heap.clear()
+            self._jobs.clear()
+            self._thread = None
+            self._executor = None
+            self._pid = os.getpid()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="playback-job")
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, name="playback-scheduler", daemon=True)
+            self._thread.start()
+
+    # Run fn after delay seconds, replacing any pending job with the same key
+    # (or, with replace=False, leaving a pending job alone and returning it)
+    def schedule(self, key, delay, fn, replace=True):
+        with self._cond:
+            self._ensure_thread()
+            previous = self._jobs.get(key)
+            if previous and not replace:
+                return previous
+            if previous:
+                del self._jobs[key]
+                previous.cancelled = True
+            job = ScheduledJob(self, key, time.monotonic() + delay, fn)
+            self._jobs[key] = job
+            heapq.heappush(self._heap, (job.deadline, next(self._seq), job))
+            self._compact()
+            self._cond.notify()
+        return job
+
+    def cancel(self, key):
+        with self._cond:
+            job = self._jobs.pop(key, None)
+            if job:
+                job.cancelled = True
+        return job is not None
+
+    # Cancel every pending job whose key starts with user_id
+    def cancel_user(self, user_id):
+        with self._cond:
+            keys = [key for key in self._jobs if key[0] == user_id]
+            for key in keys:
+                self._jobs.pop(key).cancelled = True
+        return len(keys)
+
+    def _cancel_job(self, job):
+        with self._cond:
+            job.cancelled = True
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+
+    # Number of jobs waiting to run
+    def pending(self):
+        with self._cond:
+            return len(self._jobs)
+
+    # Drop cancelled entries once they outnumber live ones
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                job = heapq.heappop(self._heap)[2]
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+                return job
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            self._executor.submit(self._run_job, job)
+
+    def _run_job(self, job):
+        try:
+            job.fn()
+        except Exception:
+            logger.exception("Scheduled job failed", extra={"job": repr(job.key)})
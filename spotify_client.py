@@ -0,0 +1,128 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# Spotify endpoints, overridable to point at a local stand-in (see bench/)
+API_BASE = os.getenv("SPOTIFY_API_BASE", "https://api.spotify.com/v1").rstrip("/")
+ACCOUNTS_BASE = os.getenv("SPOTIFY_ACCOUNTS_BASE", "https://accounts.spotify.com").rstrip("/")
+
+# Connection settings, tunable per deployment
+CONNECT_TIMEOUT = float(os.getenv("SPOTIFY_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("SPOTIFY_READ_TIMEOUT", "10"))
+POOL_SIZE = int(os.getenv("SPOTIFY_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "2"))
+
+# One session per Spotify host, rebuilt after a fork so workers never share sockets
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = Lock()
+
+
+# Build a keep-alive session with a bounded pool and idempotent-only retries
+def _build_session():
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=0.2,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "PUT"]),
+        raise_on_status=False,
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=POOL_SIZE,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Get the pooled session for a base URL in the current process
+def get_session(base):
+    global _sessions_pid
+    pid = os.getpid()
+    with _sessions_lock:
+        if _sessions_pid != pid:
+            _sessions.clear()
+            _sessions_pid = pid
+        session = _sessions.get(base)
+        if session is None:
+            session = _build_session()
+            _sessions[base] = session
+        return session
+
+
+# Close every pooled connection this process opened; sessions inherited across a fork are
+# only forgotten, since their sockets still belong to the parent
+def close_sessions():
+    with _sessions_lock:
+        if _sessions_pid == os.getpid():
+            for session in _sessions.values():
+                session.close()
+        _sessions.clear()
+
+
+# Every call is timed and counted by path; paths are fixed strings, so labels stay bounded
+def _request(base, method, path, **kwargs):
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = get_session(base).request(method, f"{base}{path}", **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=path, method=method)
+        metrics.UPSTREAM_RESPONSES.inc(endpoint=path, method=method, status=status)
+        if status == 401:
+            metrics.UPSTREAM_UNAUTHORIZED.inc()
+        elif status == 429:
+            metrics.UPSTREAM_RATE_LIMITED.inc()
+
+
+def _auth_headers(access_token):
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+# Web API calls
+def api_get(path, access_token, **kwargs):
+    return _request(API_BASE, "GET", path, headers=_auth_headers(access_token), **kwargs)
+
+
+def api_put(path, access_token, **kwargs):
+    return _request(API_BASE, "PUT", path, headers=_auth_headers(access_token), **kwargs)
+
+
+# Accounts service calls (token exchange and refresh)
+def accounts_post(path, data):
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    return _request(ACCOUNTS_BASE, "POST", path, data=data, headers=headers)
+
+
+# Any answer will do: the request only exists to leave a handshaken connection in the pool
+def _open_connection(base):
+    try:
+        get_session(base).head(f"{base}/", timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        return True
+    except requests.RequestException:
+        return False
+
+
+# Open up to `connections` pooled keep-alive connections to each Spotify host, in parallel so
+# they land on separate sockets. Returns how many succeeded; failures only cost a cold start.
+def warm_up(connections=2):
+    targets = [base for base in (API_BASE, ACCOUNTS_BASE) for _ in range(min(connections, POOL_SIZE))]
+    if not targets:
+        return 0
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        return sum(pool.map(_open_connection, targets))
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+from threading import Lock
+
+# Connections a forked child inherited. They are kept referenced and never closed: closing
+# (or garbage collecting) one in the child would drop the POSIX locks SQLite holds on the
+# file for the whole process. Normally empty, since the master closes before forking.
+_inherited_connections = []
+
+
+# One connection per process to a SQLite database shared by every worker, in WAL mode so
+# readers run alongside a writer. Reopened after a fork; the schema statements run on every
+# new connection, so they must be idempotent. Hold `lock` while using the connection.
+class ProcessConnection:
+    def __init__(self, path, schema=()):
+        self.path = path
+        self.schema = list(schema)
+        self.lock = Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def get(self):
+        if self._conn is None or self._conn_pid != os.getpid():
+            if self._conn is not None:
+                _inherited_connections.append(self._conn)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                conn.execute(statement)
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    # Run fn(conn) inside one write transaction
+    def transaction(self, fn):
+        conn = self.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    # Close this process's connection; the next get() reopens it. Call before forking so
+    # that no connection crosses the fork.
+    def close(self):
+        with self.lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._conn_pid = None
@@ -0,0 +1,44 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+import spotify_client  # noqa: E402
+from device_cache import DeviceCache  # noqa: E402
+from fake_spotify import FakeSpotifyConfig, start_fake_spotify  # noqa: E402
+from rate_limit import RateGovernor  # noqa: E402
+from scheduler import PlaybackScheduler  # noqa: E402
+from user_state import MemoryUserState  # noqa: E402
+
+
+# A fake Spotify on a free port, with spotify_client pointed at it for the test
+@pytest.fixture
+def fake_spotify(monkeypatch):
+    server = start_fake_spotify(FakeSpotifyConfig(latency_ms=20, jitter_ms=0))
+    monkeypatch.setattr(spotify_client, "API_BASE", f"{server.base_url}/v1")
+    monkeypatch.setattr(spotify_client, "ACCOUNTS_BASE", server.base_url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# The app module talking to the fake Spotify, with in-memory storage, budgets that never
+# bind and fresh per-test state. Users u1..u3 are logged in.
+@pytest.fixture
+def app_module(fake_spotify, monkeypatch):
+    monkeypatch.setenv("TOKEN_STORE", "memory")
+    import app
+
+    monkeypatch.setattr(app, "rate_governor", RateGovernor(global_rate=1000, global_burst=1000,
+                                                           user_rate=1000, user_burst=1000))
+    monkeypatch.setattr(app, "device_cache", DeviceCache(ttl=300, max_size=100))
+    monkeypatch.setattr(app, "user_state", MemoryUserState())
+    monkeypatch.setattr(app, "scheduler", PlaybackScheduler())
+    for user_id in ("u1", "u2", "u3"):
+        app.token_store.put(user_id, {"access_token": "a", "refresh_token": "r", "expires_at": time.time() + 3600})
+    return app
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def test_bad_batches_are_refused(app_module, client, monkeypatch):
+    assert client.post("/vscode/events", json={}).status_code == 400
+    response = client.post("/vscode/events", json={"events": [{"user_id": "u1", "outcome": "success"}],
+                                                   "reduce": "loudest"})
+    assert response.status_code == 400
+
+    monkeypatch.setattr(app_module, "BATCH_MAX_EVENTS", 2)
+    response = client.post("/vscode/events", json=[{"user_id": "u1", "outcome": "success"}] * 3)
+    assert response.status_code == 413
+
+
+def test_every_item_gets_a_status(app_module, client, fake_spotify):
+    app_module.rate_governor.observe_rate_limit("u2", "30")
+    response = client.post("/vscode/events", json={"events": [
+        {"user_id": "u1", "outcome": "success", "timestamp": 1},
+        {"user_id": "u1", "outcome": "error", "error_code": "syntax_error", "timestamp": 2},
+        {"user_id": "u2", "outcome": "success"},
+        {"user_id": "nobody", "outcome": "success"},
+        {"outcome": "success"},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [result["status"] for result in results] == ["coalesced", "played", "rate_limited", "rejected", "rejected"]
+    assert results[0]["applied_index"] == 1
+    assert results[1]["http_status"] == 200
+    assert 29 <= results[2]["retry_after"] <= 30
+    assert fake_spotify.stats()["calls"]["play"] == 1
+
+
+def test_async_batch_queues_one_event_per_user(app_module, client):
+    response = client.post("/vscode/events", json={"async": True, "events": [
+        {"user_id": "u1", "outcome": "error", "error_code": "syntax_error"},
+        {"user_id": "u1", "outcome": "success"},
+    ]})
+    assert response.status_code == 202
+    coalesced, queued = response.get_json()["results"]
+    assert queued["status"] == "queued" and coalesced["status"] == "coalesced"
+
+    deadline = time.monotonic() + 2
+    while client.get(f"/vscode/events/{queued['event_id']}").get_json()["status"] != "done":
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_time_limit_cancels_waiting_plays(app_module, client, fake_spotify, monkeypatch):
+    fake_spotify.config.latency_ms = 500
+    monkeypatch.setattr(app_module, "BATCH_TIMEOUT", 0.3)
+    monkeypatch.setattr(app_module, "BATCH_WORKERS", 1)
+    monkeypatch.setattr(app_module, "_batch_pool", None)
+    monkeypatch.setattr(app_module, "_batch_pool_pid", None)
+
+    started = time.monotonic()
+    response = client.post("/vscode/events", json=[
+        {"user_id": user_id, "outcome": "success"} for user_id in ("u1", "u2", "u3")
+    ])
+    assert time.monotonic() - started < 1
+    results = response.get_json()["results"]
+    assert [result["status"] for result in results] == ["timed_out", "rejected", "rejected"]
+    assert results[1]["retry_after"] == 1
@@ -0,0 +1,36 @@
+import json
+from pathlib import Path
+
+from classifier import RULES, UNKNOWN, classifier
+from tracks import TrackRegistry
+
+TRACKS_FILE = Path(__file__).resolve().parent.parent / "tracks.json"
+
+
+def test_every_classified_kind_has_a_track():
+    with open(TRACKS_FILE) as f:
+        kinds = set(json.load(f)["errors"])
+    assert {error_code for error_code, _, _ in RULES} <= kinds
+
+
+def test_last_recognised_error_wins():
+    output = (
+        "Traceback (most recent call last):\n"
+        "KeyError: 'a'\n\nDuring handling of the above exception, another exception occurred:\n\n"
+        "ZeroDivisionError: division by zero\n"
+    )
+    assert classifier.classify(output) == ("type_error", "ZeroDivisionError")
+
+
+def test_other_languages_and_unknown_output():
+    assert classifier.classify("ReferenceError: x is not defined").error_code == "name_error"
+    assert classifier.classify("main.c:3:5: error: expected ';' before '}'").error_code == "syntax_error"
+    assert classifier.classify("bash: foo: command not found").error_code == "name_error"
+    assert classifier.classify("Segmentation fault (core dumped)") == UNKNOWN
+    assert classifier.classify("") == UNKNOWN
+
+
+def test_missing_track_file_falls_back_to_unknown_error(tmp_path):
+    registry = TrackRegistry(str(tmp_path / "missing.json"))
+    assert registry.error_track("key_error") == registry.error_track("unknown_error")
+    assert registry.success_track().track_uri.startswith("spotify:track:")
@@ -0,0 +1,25 @@
+import time
+
+from device_cache import DeviceCache
+
+
+def test_entries_expire_after_ttl():
+    cache = DeviceCache(ttl=0.05)
+    cache.set("u1", "d1")
+    assert cache.get("u1") == "d1"
+    time.sleep(0.1)
+    assert cache.get("u1") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_user_is_evicted():
+    cache = DeviceCache(max_size=2)
+    cache.set("u1", "d1")
+    cache.set("u2", "d2")
+    assert cache.get("u1") == "d1"
+    cache.set("u3", "d3")
+    assert cache.get("u2") is None
+    assert (cache.get("u1"), cache.get("u3")) == ("d1", "d3")
+
+    cache.invalidate("u1")
+    assert cache.get("u1") is None and len(cache) == 1
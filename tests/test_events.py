@@ -0,0 +1,98 @@
+import sqlite3
+import time
+from threading import Event
+
+from events import EventQueue, MemoryEventStatuses, SQLiteEventStatuses, reduce_batch
+
+
+def wait_for(queue, event_id, status, timeout=2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        current = queue.status(event_id)
+        if current and current["status"] == status:
+            return current
+        time.sleep(0.01)
+    raise AssertionError(f"{event_id} never reached {status}: {queue.status(event_id)}")
+
+
+def test_status_is_visible_from_another_worker(tmp_path):
+    path = str(tmp_path / "events.db")
+    owner = EventQueue(lambda user_id: ({"played": user_id}, 200), statuses=SQLiteEventStatuses(path))
+    other = EventQueue(lambda user_id: ({}, 200), statuses=SQLiteEventStatuses(path))
+
+    event_id = owner.submit("u1")
+
+    done = wait_for(other, event_id, "done")
+    assert done["http_status"] == 200 and done["result"] == {"played": "u1"}
+    assert other.status("missing") is None
+
+
+def test_waiting_event_is_superseded_by_a_newer_one():
+    release = Event()
+    played = []
+
+    def handler(user_id, label):
+        release.wait(2)
+        played.append(label)
+        return {}, 200
+
+    queue = EventQueue(handler, workers=2)
+    first = queue.submit("u1", "first")
+    wait_for(queue, first, "running")
+    second = queue.submit("u1", "second")
+    third = queue.submit("u1", "third")
+    release.set()
+
+    wait_for(queue, third, "done")
+    assert queue.status(second) == {"status": "superseded", "superseded_by": third, "event_id": second}
+    assert played == ["first", "third"]
+
+
+def test_reduce_batch_keeps_the_newest_outcome_per_user():
+    records = [
+        {"user_id": "u1", "outcome": "error", "timestamp": 20},
+        {"user_id": "u1", "outcome": "success", "timestamp": 10},
+        {"user_id": "u2", "outcome": "success"},
+        {"user_id": "u2", "outcome": "error"},
+        {"outcome": "success"},
+        {"user_id": "u3", "outcome": "maybe"},
+    ]
+    chosen, rejected = reduce_batch(records)
+    assert chosen == {"u1": 0, "u2": 3}
+    assert sorted(rejected) == [4, 5]
+
+
+def test_reduce_batch_error_wins():
+    records = [
+        {"user_id": "u1", "outcome": "error", "timestamp": "2024-01-01T00:00:00Z"},
+        {"user_id": "u1", "outcome": "success", "timestamp": "2024-01-01T00:00:05Z"},
+        {"user_id": "u2", "outcome": "success"},
+    ]
+    chosen, rejected = reduce_batch(records, "error_wins")
+    assert chosen == {"u1": 0, "u2": 2}
+    assert rejected == {}
+
+
+class FailingStatuses(MemoryEventStatuses):
+    def set(self, event_id, status, seq):
+        if status["status"] in ("queued", "running"):
+            raise sqlite3.OperationalError("database is locked")
+        super().set(event_id, status, seq)
+
+
+def test_failed_status_writes_do_not_wedge_the_user():
+    played = []
+    queue = EventQueue(lambda user_id, name: (played.append(name) or {}, 200), workers=1, statuses=FailingStatuses())
+    first = queue.submit("u1", "first")
+    wait_for(queue, first, "done")
+    second = queue.submit("u1", "second")
+    wait_for(queue, second, "done")
+    assert played == ["first", "second"]
+    assert queue.pending() == 0
+
+
+def test_late_status_writes_are_ignored(tmp_path):
+    for statuses in (MemoryEventStatuses(), SQLiteEventStatuses(str(tmp_path / "events.db"))):
+        statuses.set("e1", {"status": "running"}, 2)
+        statuses.set("e1", {"status": "queued"}, 1)
+        assert statuses.get("e1") == {"status": "running"}
@@ -0,0 +1,42 @@
+import json
+
+import metrics
+
+
+def write(directory, name, registry):
+    (directory / name).write_text(json.dumps(registry.snapshot()))
+
+
+def make_registry(requests, in_flight):
+    registry = metrics.Registry()
+    registry.counter("requests_total", "Requests").inc(requests)
+    registry.gauge("in_flight", "In flight").set(in_flight)
+    return registry
+
+
+def test_exited_workers_keep_their_counters(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "_alive", lambda pid: True)
+    write(tmp_path, "101.json", make_registry(5, 2))
+    write(tmp_path, "102.json", make_registry(7, 3))
+
+    metrics.mark_process_dead(101)
+    assert not (tmp_path / "101.json").exists()
+    # A new worker reusing pid 101 starts from zero without lowering the total
+    write(tmp_path, "101.json", make_registry(1, 1))
+    metrics.mark_process_dead(102)
+
+    merged = metrics.merge_snapshots(
+        [(json.loads(path.read_text()), path.stem.isdigit()) for path in tmp_path.glob("*.json")]
+    )
+    assert merged["requests_total"]["samples"] == {(): 13}
+    assert merged["in_flight"]["samples"] == {(): 1}
+
+
+def test_clear_snapshots_removes_old_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    write(tmp_path, "999.json", make_registry(1, 1))
+    (tmp_path / metrics.ARCHIVE_FILE).write_text("{}")
+
+    metrics.clear_snapshots()
+    assert list(tmp_path.iterdir()) == []
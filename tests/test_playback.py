@@ -0,0 +1,61 @@
+import time
+
+import spotify_client
+
+from user_state import SQLiteUserState
+
+
+def test_pause_is_skipped_once_another_worker_started_a_newer_play(app_module, fake_spotify):
+    old_play = app_module.user_state.start_play("u1")
+    app_module.schedule_pause("u1", "bench-device", 50, old_play)
+    app_module.user_state.start_play("u1")
+    time.sleep(0.3)
+    assert fake_spotify.stats()["calls"].get("pause", 0) == 0
+
+    app_module.schedule_pause("u1", "bench-device", 50, app_module.user_state.current_play("u1"))
+    time.sleep(0.3)
+    assert fake_spotify.stats()["calls"]["pause"] == 1
+
+
+def test_latest_play_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "state.db")
+    worker1, worker2 = SQLiteUserState(path), SQLiteUserState(path)
+    first = worker1.start_play("u1")
+    assert worker2.current_play("u1") == first
+    second = worker2.start_play("u1")
+    assert worker1.current_play("u1") == second != first
+    assert worker1.current_play("u2") is None
+
+
+TRACK = "spotify:track:test"
+
+
+def test_stale_cached_device_is_replaced_and_the_play_retried(app_module, fake_spotify, monkeypatch):
+    app_module.device_cache.set("u1", "gone-device")
+    fake_spotify.config.rate_404 = 1.0
+    api_put = spotify_client.api_put
+
+    def put_then_recover(*args, **kwargs):
+        response = api_put(*args, **kwargs)
+        fake_spotify.config.rate_404 = 0.0
+        return response
+
+    monkeypatch.setattr(spotify_client, "api_put", put_then_recover)
+    device_id, response, error = app_module.play_on_device("u1", TRACK, 0)
+    assert error is None and response.status_code == 204
+    assert device_id == app_module.device_cache.get("u1") == "bench-device"
+    assert fake_spotify.stats()["statuses"] == {"play 404": 1, "devices 200": 1, "play 204": 1}
+
+
+def test_hinted_device_is_retried_only_once(app_module, fake_spotify):
+    fake_spotify.config.rate_404 = 1.0
+    device_id, response, error = app_module.play_on_device("u1", TRACK, 0, device_hint="gone-device")
+    assert error is None and response.status_code == 404
+    assert fake_spotify.stats()["statuses"] == {"play 404": 2, "devices 200": 1}
+
+
+def test_freshly_looked_up_device_is_not_retried(app_module, fake_spotify):
+    fake_spotify.config.rate_404 = 1.0
+    device_id, response, error = app_module.play_on_device("u1", TRACK, 0)
+    assert device_id == "bench-device" and response.status_code == 404
+    assert fake_spotify.stats()["statuses"] == {"play 404": 1, "devices 200": 1}
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from rate_limit import Overloaded, RateGovernor, RateLimited
+from user_state import SQLiteUserState
+
+
+def test_user_burst_then_refill():
+    governor = RateGovernor(global_rate=100, global_burst=100, user_rate=20, user_burst=2)
+    for _ in range(2):
+        with governor.admitted("u1"):
+            pass
+    with pytest.raises(RateLimited) as e:
+        governor.admit("u1")
+    assert e.value.retry_after == 1 and 0 < e.value.wait <= 0.05
+
+    governor.admit("u1", deadline=time.monotonic() + 1)
+    governor.release()
+    with governor.admitted("u2"):
+        assert governor.inflight() == 1
+
+
+def test_global_refusal_refunds_the_user_token():
+    governor = RateGovernor(global_rate=0.01, global_burst=1, user_rate=0.01, user_burst=1)
+    with governor.admitted("u1"):
+        pass
+    with pytest.raises(RateLimited, match="for the app"):
+        governor.admit("u2")
+    governor._global.tokens = 1
+    with governor.admitted("u2"):
+        pass
+
+
+def test_inflight_cap_and_cooldown():
+    governor = RateGovernor(max_inflight=1)
+    governor.admit("u1")
+    with pytest.raises(Overloaded):
+        governor.admit("u2")
+    governor.release()
+
+    assert governor.observe_rate_limit("u1", "3") == 3
+    with pytest.raises(RateLimited) as e:
+        governor.admit("u1")
+    assert e.value.retry_after == 3
+    governor.check_cooldown("u2")
+    assert governor.observe_rate_limit("u2", "soon") == 1
+
+
+def test_cooldown_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "state.db")
+    worker1 = RateGovernor(cooldowns=SQLiteUserState(path))
+    worker2 = RateGovernor(cooldowns=SQLiteUserState(path))
+    assert worker2.cooldown_remaining("u1") == 0
+
+    worker1.observe_rate_limit("u1", "5")
+    assert 4 < worker2.cooldown_remaining("u1") <= 5
+    with pytest.raises(RateLimited, match="slow down"):
+        worker2.admit("u1")
+    worker2.check_cooldown("u2")
@@ -0,0 +1,39 @@
+import time
+from threading import Event
+
+from scheduler import PlaybackScheduler
+
+
+def test_slow_job_does_not_delay_other_users():
+    scheduler = PlaybackScheduler(workers=2)
+    release = Event()
+    ran = Event()
+    scheduler.schedule(("u1", "d"), 0, lambda: release.wait(5))
+    scheduler.schedule(("u2", "d"), 0.05, ran.set)
+    try:
+        assert ran.wait(1)
+    finally:
+        release.set()
+
+
+def test_rescheduling_a_key_replaces_its_job():
+    scheduler = PlaybackScheduler()
+    calls = []
+    scheduler.schedule(("u1", "d"), 0.05, lambda: calls.append("old"))
+    scheduler.schedule(("u1", "d"), 0.05, lambda: calls.append("new"))
+    kept = scheduler.schedule(("u1", "d"), 0.05, lambda: calls.append("ignored"), replace=False)
+    assert scheduler.pending() == 1
+    time.sleep(0.2)
+    assert calls == ["new"]
+    assert kept.key == ("u1", "d")
+
+
+def test_cancel_user_drops_only_that_users_jobs():
+    scheduler = PlaybackScheduler()
+    calls = []
+    scheduler.schedule(("u1", "a"), 0.05, lambda: calls.append("u1a"))
+    scheduler.schedule(("u1", "b"), 0.05, lambda: calls.append("u1b"))
+    scheduler.schedule(("u2", "a"), 0.05, lambda: calls.append("u2a"))
+    assert scheduler.cancel_user("u1") == 2
+    time.sleep(0.2)
+    assert calls == ["u2a"]
@@ -0,0 +1,9 @@
+import spotify_client
+
+
+def test_close_sessions_drops_pooled_connections(fake_spotify):
+    session = spotify_client.get_session(spotify_client.API_BASE)
+    assert spotify_client.api_get("/me", "token").status_code == 200
+
+    spotify_client.close_sessions()
+    assert spotify_client.get_session(spotify_client.API_BASE) is not session
@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import spotify_client
+from token_manager import TokenManager
+from token_store import MemoryTokenStore
+
+
+def make_manager(store):
+    return TokenManager(store.get, store.put, "client", "secret")
+
+
+def get_me(access_token):
+    return spotify_client.api_get("/me", access_token)
+
+
+def test_concurrent_calls_with_expired_token_refresh_once(fake_spotify):
+    store = MemoryTokenStore()
+    store.put("u1", {"access_token": "expired", "refresh_token": "r", "expires_at": time.time() - 10})
+    manager = make_manager(store)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(lambda _: manager.call("u1", get_me), range(16)))
+
+    assert [response.status_code for response in responses] == [200] * 16
+    assert fake_spotify.stats()["calls"]["token"] == 1
+    assert store.get("u1")["access_token"] != "expired"
+
+
+def test_unauthorized_response_refreshes_once_and_retries(fake_spotify):
+    store = MemoryTokenStore()
+    store.put("u1", {"access_token": "revoked", "refresh_token": "r", "expires_at": time.time() + 3600})
+    manager = make_manager(store)
+    fake_spotify.config.rate_401 = 1.0
+    sent = []
+
+    def request_fn(access_token):
+        sent.append(access_token)
+        response = get_me(access_token)
+        fake_spotify.config.rate_401 = 0.0
+        return response
+
+    response = manager.call("u1", request_fn)
+
+    assert response.status_code == 200
+    stats = fake_spotify.stats()
+    assert stats["calls"]["token"] == 1
+    assert stats["statuses"] == {"me 401": 1, "token 200": 1, "me 200": 1}
+    assert len(sent) == 2
+    assert sent[0] == "revoked" and sent[1] == store.get("u1")["access_token"]
@@ -0,0 +1,59 @@
+from events import SQLiteEventStatuses
+from token_store import CachedTokenStore, MemoryTokenStore, SQLiteTokenStore
+
+
+def test_unknown_users_are_not_cached():
+    store = CachedTokenStore(MemoryTokenStore())
+    for i in range(100):
+        assert store.get(f"nobody-{i}") is None
+    assert store._records == {}
+
+    store.backend.put("late", {"access_token": "a"})
+    assert store.get("late") == {"access_token": "a"}
+
+
+def test_writes_from_another_connection_invalidate_the_cache(tmp_path):
+    path = str(tmp_path / "tokens.db")
+    store = CachedTokenStore(SQLiteTokenStore(path))
+    store.put("u1", {"access_token": "old"})
+    assert store.get("u1") == {"access_token": "old"}
+
+    SQLiteTokenStore(path).put("u1", {"access_token": "new"})
+    assert store.get("u1") == {"access_token": "new"}
+
+
+def test_close_keeps_cached_records_and_reopens_on_demand(tmp_path):
+    store = CachedTokenStore(SQLiteTokenStore(str(tmp_path / "tokens.db")))
+    store.put("u1", {"access_token": "a"})
+    assert store.warm() == 1
+
+    store.close()
+    assert store.backend.db._conn is None
+    assert store._records == {"u1": {"access_token": "a"}}
+    assert store.get("u1") == {"access_token": "a"}
+
+
+def test_cache_survives_writes_to_other_tables_in_the_same_file(tmp_path):
+    path = str(tmp_path / "tokens.db")
+    store = CachedTokenStore(SQLiteTokenStore(path))
+    store.put("u1", {"access_token": "a"})
+    store.put("u2", {"access_token": "b"})
+    store.warm()
+
+    SQLiteEventStatuses(path).set("event-1", {"status": "queued"}, 1)
+    assert store.get("u1") == {"access_token": "a"}
+    assert store._records == {"u1": {"access_token": "a"}, "u2": {"access_token": "b"}}
+
+
+def test_own_writes_keep_the_cache_and_versions_match_across_connections(tmp_path):
+    path = str(tmp_path / "tokens.db")
+    store = CachedTokenStore(SQLiteTokenStore(path))
+    store.put("u1", {"access_token": "a"})
+    store.warm()
+    store.put("u2", {"access_token": "b"})
+    assert set(store._records) == {"u1", "u2"}
+    assert SQLiteTokenStore(path).version() == store.version()
+
+    SQLiteTokenStore(path).put("u3", {"access_token": "c"})
+    store.put("u1", {"access_token": "a2"})
+    assert store._records == {"u1": {"access_token": "a2"}}
@@ -0,0 +1,135 @@
+import time
+from threading import Event, Lock
+
+import requests
+
+import metrics
+import spotify_client
+from logging_setup import get_logger
+
+logger = get_logger("tokens")
+
+
+# Raised when a user has no access token that can be used or refreshed
+class TokenUnavailable(Exception):
+    pass
+
+
+# One in-progress refresh that concurrent callers for the same user wait on
+class _Refresh:
+    def __init__(self):
+        self.done = Event()
+        self.access_token = None
+
+
+# Expiry-aware access tokens with proactive refresh, single-flight dedup and 401 retry.
+# get_record(user_id) returns the stored token dict, put_record(user_id, record) persists it.
+class TokenManager:
+    def __init__(self, get_record, put_record, client_id, client_secret, refresh_margin=60, wait_timeout=15):
+        self._get_record = get_record
+        self._put_record = put_record
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self.wait_timeout = wait_timeout
+        self._inflight = {}
+        self._lock = Lock()
+
+    # Build the record stored for a token endpoint response
+    @staticmethod
+    def record_from_response(data, previous=None):
+        record = dict(previous or {})
+        record["access_token"] = data.get("access_token")
+        if data.get("refresh_token"):
+            record["refresh_token"] = data["refresh_token"]
+        if data.get("expires_in"):
+            record["expires_at"] = time.time() + int(data["expires_in"])
+        return record
+
+    def _expiring(self, record):
+        expires_at = record.get("expires_at")
+        return expires_at is not None and expires_at - self.refresh_margin <= time.time()
+
+    # Current access token, refreshed first if it is missing or about to expire
+    def get_access_token(self, user_id):
+        record = self._get_record(user_id)
+        if not record:
+            return None
+        access_token = record.get("access_token")
+        if access_token and not self._expiring(record):
+            return access_token
+        return self.refresh(user_id, stale_token=access_token)
+
+    # Refresh a user's token. Concurrent callers share one request to the accounts service,
+    # and a caller holding a token that has already been replaced gets the new one for free.
+    def refresh(self, user_id, stale_token=None):
+        with self._lock:
+            pending = self._inflight.get(user_id)
+            leader = pending is None
+            if leader:
+                record = self._get_record(user_id)
+                current = record.get("access_token") if record else None
+                if stale_token and current and current != stale_token and not self._expiring(record):
+                    return current
+                pending = _Refresh()
+                self._inflight[user_id] = pending
+
+        if not leader:
+            pending.done.wait(self.wait_timeout)
+            return pending.access_token
+
+        try:
+            pending.access_token = self._request_refresh(user_id)
+        finally:
+            with self._lock:
+                self._inflight.pop(user_id, None)
+            pending.done.set()
+        return pending.access_token
+
+    def _request_refresh(self, user_id):
+        record = self._get_record(user_id)
+        if not record:
+            logger.warning("No tokens found for user", extra={"user_id": user_id})
+            return None
+
+        refresh_token = record.get("refresh_token")
+        if not refresh_token:
+            logger.warning("No refresh token for user", extra={"user_id": user_id})
+            return None
+
+        payload = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+        }
+        try:
+            response = spotify_client.accounts_post("/api/token", payload)
+        except requests.RequestException as e:
+            metrics.TOKEN_REFRESHES.inc(result="error")
+            logger.warning("Token refresh failed", extra={"user_id": user_id, "error": str(e)})
+            return None
+
+        if response.status_code != 200:
+            metrics.TOKEN_REFRESHES.inc(result="rejected")
+            logger.warning("Token refresh rejected", extra={"user_id": user_id, "status": response.status_code})
+            return None
+
+        metrics.TOKEN_REFRESHES.inc(result="success")
+        logger.info("Access token refreshed", extra={"user_id": user_id})
+
+        record = self.record_from_response(response.json(), previous=record)
+        self._put_record(user_id, record)
+        return record["access_token"]
+
+    # Run request_fn(access_token); on a 401 refresh once and retry with the new token
+    def call(self, user_id, request_fn):
+        access_token = self.get_access_token(user_id)
+        if not access_token:
+            raise TokenUnavailable(user_id)
+        response = request_fn(access_token)
+        if response.status_code == 401:
+            access_token = self.refresh(user_id, stale_token=access_token)
+            if access_token:
+                response = request_fn(access_token)
+        return response
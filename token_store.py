@@ -0,0 +1,230 @@
+import json
+import os
+import time
+from threading import Lock
+
+from sqlite_db import ProcessConnection
+
+
+# Token records kept in this process only
+class MemoryTokenStore:
+    def __init__(self):
+        self._records = {}
+        self._version = 0
+        self._lock = Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            record = self._records.get(user_id)
+            return dict(record) if record else None
+
+    # Returns the store version after the write
+    def put(self, user_id, record):
+        with self._lock:
+            self._records[user_id] = dict(record)
+            self._version += 1
+            return self._version
+
+    def delete(self, user_id):
+        with self._lock:
+            self._records.pop(user_id, None)
+            self._version += 1
+
+    def import_records(self, records):
+        with self._lock:
+            for user_id, record in records.items():
+                self._records.setdefault(user_id, dict(record))
+            self._version += 1
+
+    def user_ids(self, limit=None):
+        with self._lock:
+            user_ids = list(self._records)
+        return user_ids[:limit] if limit else user_ids
+
+    # Counts writes to the token records
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def close(self):
+        pass
+
+
+# Token records in a SQLite database shared by every worker. WAL mode lets readers run
+# alongside a writer, each user is one row, and every write is a single atomic upsert.
+# Triggers count writes to the tokens table in tokens_version, so the version ignores the
+# other tables kept in the same file and reads the same from every process.
+class SQLiteTokenStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = ProcessConnection(
+            path,
+            [
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "user_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)",
+                "CREATE TABLE IF NOT EXISTS tokens_version ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)",
+                "INSERT OR IGNORE INTO tokens_version (id, version) VALUES (0, 0)",
+            ]
+            + [
+                f"CREATE TRIGGER IF NOT EXISTS tokens_{op.lower()} AFTER {op} ON tokens "
+                "BEGIN UPDATE tokens_version SET version = version + 1; END"
+                for op in ("INSERT", "UPDATE", "DELETE")
+            ],
+        )
+
+    def get(self, user_id):
+        with self.db.lock:
+            row = self.db.get().execute(
+                "SELECT record FROM tokens WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Returns the store version after the write, read in the same transaction
+    def put(self, user_id, record):
+        def write(conn):
+            conn.execute(
+                "INSERT INTO tokens (user_id, record, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET record = excluded.record, updated_at = excluded.updated_at",
+                (user_id, json.dumps(record), time.time()),
+            )
+            return conn.execute("SELECT version FROM tokens_version").fetchone()[0]
+
+        with self.db.lock:
+            return self.db.transaction(write)
+
+    def delete(self, user_id):
+        with self.db.lock:
+            self.db.get().execute("DELETE FROM tokens WHERE user_id = ?", (user_id,))
+
+    # Add users that are not stored yet, in one transaction
+    def import_records(self, records):
+        rows = [(user_id, json.dumps(record), time.time()) for user_id, record in records.items()]
+        with self.db.lock:
+            self.db.transaction(
+                lambda conn: conn.executemany(
+                    "INSERT OR IGNORE INTO tokens (user_id, record, updated_at) VALUES (?, ?, ?)", rows
+                )
+            )
+
+    def user_ids(self, limit=None):
+        query = "SELECT user_id FROM tokens ORDER BY updated_at DESC"
+        with self.db.lock:
+            if limit:
+                rows = self.db.get().execute(query + " LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = self.db.get().execute(query).fetchall()
+        return [row[0] for row in rows]
+
+    # Counts writes to the token records, whichever process made them
+    def version(self):
+        with self.db.lock:
+            return self.db.get().execute("SELECT version FROM tokens_version").fetchone()[0]
+
+    # Close this process's connection; the next call reopens it. Call before forking so that
+    # no connection crosses the fork.
+    def close(self):
+        self.db.close()
+
+
+# Read-through per-worker cache over a backend store. Writes from this worker update the
+# cache directly; writes from any other worker bump the backend version and drop it. The
+# version is the same in every process, so a cache filled by warm() before a fork is kept
+# by the forked workers until a token actually changes.
+class CachedTokenStore:
+    def __init__(self, backend):
+        self.backend = backend
+        self._records = {}
+        self._version = None
+        self._lock = Lock()
+
+    def _check_version(self):
+        version = self.backend.version()
+        if version != self._version:
+            self._records.clear()
+            self._version = version
+
+    def get(self, user_id):
+        with self._lock:
+            self._check_version()
+            record = self._records.get(user_id)
+            if record is None:
+                # Misses are not cached: any request can name an unknown user
+                record = self.backend.get(user_id)
+                if record:
+                    self._records[user_id] = record
+        return dict(record) if record else None
+
+    def put(self, user_id, record):
+        with self._lock:
+            version = self.backend.put(user_id, record)
+            # Any step beyond our own write is another worker's write landing in between
+            if self._version is None or version != self._version + 1:
+                self._records.clear()
+            self._version = version
+            self._records[user_id] = dict(record)
+
+    def delete(self, user_id):
+        self.backend.delete(user_id)
+        self.invalidate(user_id)
+
+    def import_records(self, records):
+        self.backend.import_records(records)
+        self.invalidate()
+
+    def user_ids(self, limit=None):
+        return self.backend.user_ids(limit)
+
+    def version(self):
+        return self.backend.version()
+
+    # Closes the backend's connection; cached records stay
+    def close(self):
+        self.backend.close()
+
+    # Drop one user, or everything, from this worker's cache
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._records.clear()
+            else:
+                self._records.pop(user_id, None)
+
+    # Load the most recently updated users into the cache ahead of their first event
+    def warm(self, limit=None):
+        with self._lock:
+            # A write landing while loading moves the version on and drops the cache later
+            self._check_version()
+            user_ids = self.backend.user_ids(limit)
+            for user_id in user_ids:
+                if user_id not in self._records:
+                    record = self.backend.get(user_id)
+                    if record:
+                        self._records[user_id] = record
+        return len(user_ids)
+
+
+# Build the configured backend ("sqlite" or "memory")
+def create_token_store(kind="sqlite", path="spotify_tokens.db"):
+    if kind == "memory":
+        return MemoryTokenStore()
+    if kind == "sqlite":
+        return SQLiteTokenStore(path)
+    raise ValueError(f"Unknown token store: {kind}")
+
+
+# Move users from the legacy JSON token file into the store, then retire the file.
+# Safe to run from several workers at once: existing rows are never overwritten.
+def migrate_json_tokens(store, json_path):
+    try:
+        with open(json_path, "r") as f:
+            records = json.load(f)
+    except FileNotFoundError:
+        return 0
+
+    store.import_records(records)
+    try:
+        os.replace(json_path, json_path + ".migrated")
+    except FileNotFoundError:
+        pass
+    return len(records)
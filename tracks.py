@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from collections import namedtuple
+from threading import Lock
+from types import MappingProxyType
+
+from logging_setup import get_logger
+
+logger = get_logger("tracks")
+
+Track = namedtuple("Track", "track_uri start_position_ms stop_time_ms")
+
+# Minimal fallback used until tracks.json loads: every error plays the unknown_error track.
+# The real track list lives only in the file.
+DEFAULT_CONFIG = {
+    "success": {"track_uri": "spotify:track:0O3ow3j5y8q3ykRs2K2n1b", "start_position_ms": 45000, "stop_time_ms": 15000},
+    "errors": {
+        "unknown_error": {"track_uri": "spotify:track:5QIQWDc5c20Sn5sEUwsqdU", "start_position_ms": 0, "stop_time_ms": 3000},
+    },
+}
+
+
+def _track(data):
+    track = Track(data["track_uri"], int(data["start_position_ms"]), int(data["stop_time_ms"]))
+    if not isinstance(track.track_uri, str) or not track.track_uri.startswith("spotify:"):
+        raise ValueError(f"Invalid track URI: {track.track_uri!r}")
+    return track
+
+
+def _tracks(section):
+    return MappingProxyType({code: _track(data) for code, data in (section or {}).items()})
+
+
+# Validate a config dict and freeze it into read-only lookup tables
+def build_table(config):
+    errors = _tracks(config.get("errors"))
+    if "unknown_error" not in errors:
+        raise ValueError("errors.unknown_error is required")
+    users = {}
+    for user_id, overrides in (config.get("users") or {}).items():
+        success = overrides.get("success")
+        users[user_id] = MappingProxyType({
+            "success": _track(success) if success else None,
+            "errors": _tracks(overrides.get("errors")),
+        })
+    return MappingProxyType({
+        "success": _track(config["success"]),
+        "errors": errors,
+        "users": MappingProxyType(users),
+    })
+
+
+# Success and error tracks, loaded once from a JSON file and swapped out wholesale when the
+# file changes. Lookups read an immutable table, so they never lock or see a half-reload.
+class TrackRegistry:
+    def __init__(self, path, reload_interval=2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._table = build_table(DEFAULT_CONFIG)
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = Lock()
+        self.reload()
+
+    # Re-read the file; an invalid file is logged and the current table kept
+    def reload(self):
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                logger.warning("Track config not found, using the built-in fallback", extra={"path": self.path})
+                self._mtime = None
+                return False
+            try:
+                with open(self.path) as f:
+                    table = build_table(json.load(f))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.error("Invalid track config, keeping the previous one", extra={"path": self.path, "error": str(e)})
+                self._mtime = mtime
+                return False
+            self._table = table
+            self._mtime = mtime
+            logger.info("Track config loaded", extra={"path": self.path, "error_kinds": len(table["errors"])})
+            return True
+
+    # Hot reload: at most one stat() per reload_interval
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def success_track(self, user_id=None):
+        self._maybe_reload()
+        table = self._table
+        overrides = table["users"].get(user_id)
+        if overrides and overrides["success"]:
+            return overrides["success"]
+        return table["success"]
+
+    # The user's override for error_code, then the shared track, then unknown_error
+    def error_track(self, error_code, user_id=None):
+        self._maybe_reload()
+        table = self._table
+        overrides = table["users"].get(user_id)
+        if overrides and error_code in overrides["errors"]:
+            return overrides["errors"][error_code]
+        track = table["errors"].get(error_code)
+        if track:
+            return track
+        if overrides and "unknown_error" in overrides["errors"]:
+            return overrides["errors"]["unknown_error"]
+        return table["errors"]["unknown_error"]
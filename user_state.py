@@ -0,0 +1,95 @@
+import time
+import uuid
+from threading import Lock
+
+from sqlite_db import ProcessConnection
+
+
+# Per-user playback state and Spotify cool-downs kept in this process only
+class MemoryUserState:
+    def __init__(self):
+        self._plays = {}
+        self._cooldowns = {}
+        self._lock = Lock()
+
+    # Record that a new track started for user_id and return its play id
+    def start_play(self, user_id):
+        play_id = uuid.uuid4().hex
+        with self._lock:
+            self._plays[user_id] = play_id
+        return play_id
+
+    # Id of the user's latest play, or None
+    def current_play(self, user_id):
+        with self._lock:
+            return self._plays.get(user_id)
+
+    # Back off from user_id until `until` (time.time()); a later cool-down is kept
+    def start_cooldown(self, user_id, until):
+        with self._lock:
+            self._cooldowns[user_id] = max(until, self._cooldowns.get(user_id, 0))
+
+    # End of the user's latest cool-down, or None; it may already be over
+    def cooldown_until(self, user_id):
+        with self._lock:
+            return self._cooldowns.get(user_id)
+
+    def close(self):
+        pass
+
+
+# Per-user playback state and cool-downs in a SQLite database shared by every worker, so a
+# worker can tell when another one has started a newer track for the same user, and every
+# worker backs off a user Spotify has throttled on any of them
+class SQLiteUserState:
+    def __init__(self, path):
+        self.path = path
+        self.db = ProcessConnection(
+            path,
+            [
+                "CREATE TABLE IF NOT EXISTS plays ("
+                "user_id TEXT PRIMARY KEY, play_id TEXT NOT NULL, started_at REAL NOT NULL)",
+                "CREATE TABLE IF NOT EXISTS cooldowns (user_id TEXT PRIMARY KEY, until REAL NOT NULL)",
+            ],
+        )
+
+    def start_play(self, user_id):
+        play_id = uuid.uuid4().hex
+        with self.db.lock:
+            self.db.get().execute(
+                "INSERT INTO plays (user_id, play_id, started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET play_id = excluded.play_id, started_at = excluded.started_at",
+                (user_id, play_id, time.time()),
+            )
+        return play_id
+
+    def current_play(self, user_id):
+        with self.db.lock:
+            row = self.db.get().execute("SELECT play_id FROM plays WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def start_cooldown(self, user_id, until):
+        with self.db.lock:
+            self.db.get().execute(
+                "INSERT INTO cooldowns (user_id, until) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET until = max(until, excluded.until)",
+                (user_id, until),
+            )
+
+    def cooldown_until(self, user_id):
+        with self.db.lock:
+            row = self.db.get().execute("SELECT until FROM cooldowns WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    # Close this process's connection; the next call reopens it
+    def close(self):
+        self.db.close()
+
+
+# Build the user state store matching the token store ("sqlite" or "memory")
+def create_user_state(kind="sqlite", path="spotify_tokens.db"):
+    if kind == "memory":
+        return MemoryUserState()
+    if kind == "sqlite":
+        return SQLiteUserState(path)
+    raise ValueError(f"Unknown user state store: {kind}")